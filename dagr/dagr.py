@@ -10,12 +10,28 @@
 
 # This file is offered as-is, without any warranty.
 
+import configparser
+import cProfile
+import errno
+import heapq
 import json
+import pstats
+import queue
 import re
+import socket
+import sqlite3
 import sys
+import threading
 import traceback
 import portalocker
-from email.utils import parsedate
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from copy import copy
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from calendar import timegm
+from email.utils import formatdate, mktime_tz, parsedate, parsedate_tz
+from functools import wraps
+from hashlib import sha1, sha256
 from getopt import gnu_getopt, GetoptError
 from glob import glob
 from mimetypes import (
@@ -23,36 +39,95 @@ from mimetypes import (
     add_type as add_mimetype,
     init as mimetypes_init
     )
-from os import getcwd, makedirs, rename, utime, remove as os_remove
+from os import (
+    getcwd, link, makedirs, rename, replace, utime, remove as os_remove
+    )
 from os.path import (
     abspath, basename, dirname, exists as path_exists,
-    expanduser, join as path_join
+    expanduser, getmtime, getsize, isabs, isdir, join as path_join, relpath
     )
-from random import choice
-from time import mktime
+from random import choice, uniform
+from time import localtime, mktime, sleep, time
 
+from bs4 import BeautifulSoup, SoupStrainer
+from bs4.dammit import EncodingDetector
 from bs4.element import Tag
 from requests import (
     adapters as req_adapters,
     codes as req_codes,
     session as req_session
     )
+from requests.compat import urljoin, urlparse
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 from mechanicalsoup import StatefulBrowser
 
-# Python 2/3 compatibility stuff
-try:
-    # Python 3
-    import configparser
-except ImportError:
-    # Python 2
-    import ConfigParser as configparser
-FNF_ERROR = getattr(__builtins__, 'FileNotFoundError', IOError)
-
 
 # Helper functions
 def da_make_dirs(directory):
-    if not path_exists(directory):
+    try:
         makedirs(directory)
+    except OSError as mkdir_error:
+        # Another thread may have created it in the meantime
+        if mkdir_error.errno != errno.EEXIST or not isdir(directory):
+            raise
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter"""
+    return uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(value):
+    """Returns the seconds a Retry-After header asks to wait, None if invalid"""
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        date = parsedate_tz(value)
+        if date:
+            return max(0, mktime_tz(date) - time())
+
+
+def find_link_keep_tag(name, attrs):
+    """Tells if a top level tag of a deviation page is needed by find_link"""
+    classes = attrs.get('class') or ''
+    if not isinstance(classes, str):
+        classes = ' '.join(classes)
+    classes = classes.split()
+    if name == 'a':
+        return True
+    if name == 'div':
+        return 'dev-description' in classes
+    if name == 'span':
+        return ('cc-copy' in classes or 'dev-about-breadcrumb' in classes
+                or attrs.get('itemprop') == 'title')
+    if name == 'meta':
+        return attrs.get('property') == 'og:image'
+    if name == 'img':
+        return 'collect_rid' in attrs
+    if name == 'script':
+        return attrs.get('type') == 'text/javascript'
+    if name == 'iframe':
+        return 'flashtime' in classes
+    return False
+
+
+try:
+    # bs4 >= 4.13
+    from bs4 import ElementFilter
+
+    class FindLinkStrainer(ElementFilter):
+        def allow_tag_creation(self, nsprefix, name, attrs):
+            return find_link_keep_tag(name, attrs or {})
+
+        def allow_string_creation(self, string):
+            return False
+except ImportError:
+    # Older SoupStrainers call name functions with the tag attributes
+    def FindLinkStrainer():
+        return SoupStrainer(find_link_keep_tag)
 
 
 # Main classes
@@ -71,6 +146,621 @@ class CacheSettings():
         self.downloaded_pages = '.dagr_downloaded_pages'
         self.artists = '.artists'
         self.meta = '.meta'
+        self.backend = 'json'
+        self.database = '.dagr.sqlite'
+        self.deviants = '.deviants'
+        self.deviants_ttl = 86400
+        self.index_file = '.dagr_index.sqlite'
+
+
+class FilenameIndex(list):
+    """List of file names, indexed by deviation slug
+
+    Only a file for the very same slug counts as found: pic-10.jpg no longer
+    hides pic-1, as a substring match of the name did before.
+    """
+    def __init__(self, file_names=()):
+        super(FilenameIndex, self).__init__()
+        self.by_slug = {}
+        self.extend(file_names)
+
+    @staticmethod
+    def slug(file_name):
+        # Deviation slugs never contain dots, anything after one is extension
+        return basename(file_name).split('.', 1)[0]
+
+    def append(self, file_name):
+        super(FilenameIndex, self).append(file_name)
+        self.by_slug.setdefault(self.slug(file_name), file_name)
+
+    def extend(self, file_names):
+        for file_name in file_names:
+            self.append(file_name)
+
+    def find(self, name):
+        return self.by_slug.get(self.slug(name))
+
+
+class DeviationSet(object):
+    """Ordered set of deviation URLs, keyed by numeric deviation ID
+
+    Trades memory for lookups: the URLs are kept for the caches and
+    update_artists, each with its ID on top of it.
+    """
+    def __init__(self, urls=()):
+        self.by_id = {}
+        for url in urls:
+            self.add(url)
+
+    @staticmethod
+    def key(url):
+        deviation_id = re.search(r'-([0-9]+)$', url)
+        return int(deviation_id.group(1)) if deviation_id else url
+
+    def add(self, url):
+        self.by_id.setdefault(self.key(url), url)
+
+    def __contains__(self, url):
+        return self.key(url) in self.by_id
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def __len__(self):
+        return len(self.by_id)
+
+
+class SQLiteCacheDatabase(object):
+    """Connection to a cache database, shared by every ripper thread using it"""
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS files ('
+        'dir TEXT, name TEXT, slug TEXT, PRIMARY KEY (dir, name))',
+        'CREATE INDEX IF NOT EXISTS files_slug ON files (dir, slug)',
+        'CREATE TABLE IF NOT EXISTS pages ('
+        'dir TEXT, id TEXT, url TEXT, PRIMARY KEY (dir, id))',
+        'CREATE TABLE IF NOT EXISTS artists ('
+        'dir TEXT, name TEXT, data TEXT, PRIMARY KEY (dir, name))',
+        'CREATE TABLE IF NOT EXISTS meta ('
+        'dir TEXT, name TEXT, data TEXT, PRIMARY KEY (dir, name))',
+    )
+
+    def __init__(self, database):
+        self.path = database
+        self.connection = sqlite3.connect(database, check_same_thread=False,
+                                          timeout=30)
+        self.lock = threading.Lock()
+        self.users = 0
+        # Other processes may write to a shared database while we read it
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            for statement in SQLiteCacheDatabase.SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+
+class SQLiteCacheStore(object):
+    """Caches of one output directory, kept in a (possibly shared) database"""
+    TABLES = {
+        'filenames': 'files',
+        'downloaded_pages': 'pages',
+        'artists': 'artists',
+        'meta': 'meta'
+    }
+
+    def __init__(self, database, base_dir):
+        self.database = database
+        self.connection = database.connection
+        self.directory = relpath(base_dir, dirname(database.path))
+
+    def has(self, cache_type):
+        with self.database.lock:
+            return self.connection.execute(
+                'SELECT 1 FROM {} WHERE dir = ? LIMIT 1'.format(
+                    SQLiteCacheStore.TABLES[cache_type]),
+                (self.directory,)).fetchone() is not None
+
+    def load(self, cache_type):
+        with self.database.lock:
+            if cache_type == 'filenames':
+                rows = self.connection.execute(
+                    'SELECT name FROM files WHERE dir = ? ORDER BY rowid',
+                    (self.directory,))
+                return FilenameIndex(name for name, in rows)
+            if cache_type == 'downloaded_pages':
+                rows = self.connection.execute(
+                    'SELECT url FROM pages WHERE dir = ? ORDER BY rowid',
+                    (self.directory,))
+                return DeviationSet(url for url, in rows)
+            rows = self.connection.execute(
+                'SELECT name, data FROM {} WHERE dir = ?'.format(
+                    SQLiteCacheStore.TABLES[cache_type]),
+                (self.directory,))
+            return dict((name, json.loads(data)) for name, data in rows)
+
+    def rows(self, cache_type, entries):
+        for entry in entries:
+            if cache_type == 'filenames':
+                yield self.directory, entry, FilenameIndex.slug(entry)
+            elif cache_type == 'downloaded_pages':
+                yield self.directory, str(DeviationSet.key(entry)), entry
+            else:
+                yield self.directory, entry[0], json.dumps(entry[1])
+
+    def insert(self, cache_type, entries):
+        if cache_type in ('filenames', 'downloaded_pages'):
+            statement = 'INSERT OR IGNORE INTO {} VALUES (?, ?, ?)'
+        else:
+            statement = 'INSERT OR REPLACE INTO {} VALUES (?, ?, ?)'
+        self.connection.executemany(
+            statement.format(SQLiteCacheStore.TABLES[cache_type]),
+            self.rows(cache_type, entries))
+
+    def append(self, cache_type, entries):
+        with self.database.lock:
+            with self.connection:
+                self.insert(cache_type, entries)
+
+    def save(self, cache_type, cache_contents):
+        if isinstance(cache_contents, dict):
+            cache_contents = cache_contents.items()
+        with self.database.lock:
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM {} WHERE dir = ?'.format(
+                        SQLiteCacheStore.TABLES[cache_type]),
+                    (self.directory,))
+                self.insert(cache_type, cache_contents)
+
+
+class LinkCache(object):
+    """Resolved deviation pages, kept in a SQLite database"""
+    EVICT_INTERVAL = 100
+
+    def __init__(self, database, ttl, max_entries):
+        da_make_dirs(dirname(abspath(database)))
+        self.connection = sqlite3.connect(database, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.inserts = 0
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS links ('
+                'url TEXT PRIMARY KEY, filename TEXT, filelink TEXT,'
+                ' meta TEXT, fetched REAL)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS links_fetched ON links (fetched)')
+        self.evict()
+
+    def get(self, url):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT filename, filelink, meta FROM links'
+                ' WHERE url = ? AND fetched > ?',
+                (url, time() - self.ttl)).fetchone()
+        if row:
+            return row[0], row[1], json.loads(row[2])
+
+    def put(self, url, filename, filelink, linkmeta):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO links VALUES (?, ?, ?, ?, ?)',
+                    (url, filename, filelink, json.dumps(linkmeta), time()))
+            self.inserts += 1
+            if self.inserts % LinkCache.EVICT_INTERVAL:
+                return
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'DELETE FROM links WHERE fetched <= ?', (time() - self.ttl,))
+                self.connection.execute(
+                    'DELETE FROM links WHERE url IN (SELECT url FROM links'
+                    ' ORDER BY fetched DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,))
+
+
+class ContentIndex(object):
+    """Files under the output directory, by deviation ID and content hash"""
+    def __init__(self, database):
+        self.root = dirname(abspath(database))
+        self.connection = sqlite3.connect(database, check_same_thread=False,
+                                          timeout=30)
+        self.lock = threading.Lock()
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS content ('
+                'path TEXT PRIMARY KEY, deviation TEXT, name TEXT,'
+                ' digest TEXT, size INTEGER, meta TEXT)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS content_deviation ON content (deviation)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS content_digest ON content (digest, size)')
+
+    @staticmethod
+    def file_digest(file_name):
+        digest = sha256()
+        with open(file_name, 'rb') as filehandle:
+            for block in iter(lambda: filehandle.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def valid_rows(self, rows):
+        """Yields rows whose file is still there, forgetting the others"""
+        for row in rows:
+            full_path = path_join(self.root, row[0])
+            if path_exists(full_path) and getsize(full_path) == row[4]:
+                yield (full_path,) + tuple(row[1:])
+            else:
+                with self.lock:
+                    with self.connection:
+                        self.connection.execute(
+                            'DELETE FROM content WHERE path = ?', (row[0],))
+
+    def has(self, file_name):
+        with self.lock:
+            return self.connection.execute(
+                'SELECT 1 FROM content WHERE path = ?',
+                (relpath(file_name, self.root),)).fetchone() is not None
+
+    def find_deviation(self, url):
+        """Returns (path, deviation, name, digest, size, meta) rows of a deviation"""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT path, deviation, name, digest, size, meta FROM content'
+                ' WHERE deviation = ?', (str(DeviationSet.key(url)),)).fetchall()
+        return list(self.valid_rows(rows))
+
+    def find_content(self, digest, size):
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT path, deviation, name, digest, size, meta FROM content'
+                ' WHERE digest = ? AND size = ?', (digest, size)).fetchall()
+        return next(iter(self.valid_rows(rows)), None)
+
+    def add(self, file_name, url, name, digest, size, linkmeta):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    'INSERT OR REPLACE INTO content VALUES (?, ?, ?, ?, ?, ?)',
+                    (relpath(file_name, self.root), str(DeviationSet.key(url)),
+                     name, digest, size, json.dumps(linkmeta)))
+
+
+class RateLimiter(object):
+    """Token bucket per host, slowing down when the server pushes back"""
+    MIN_RATE = 0.1
+    # Seconds of requests looked at to find the rate of an unlimited host
+    WINDOW = 10.0
+
+    def __init__(self, rate=None):
+        # No rate means no limit until the server asks us to slow down
+        self.max_rate = rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, host):
+        if not host in self.buckets:
+            self.buckets[host] = {
+                'rate': self.max_rate, 'ceiling': self.max_rate, 'tokens': 1.0,
+                'updated': time(), 'blocked_until': 0, 'sent': deque()
+            }
+        return self.buckets[host]
+
+    def acquire(self, host):
+        while True:
+            with self.lock:
+                bucket = self.bucket(host)
+                now = time()
+                if bucket['blocked_until'] > now:
+                    wait = bucket['blocked_until'] - now
+                elif not bucket['rate']:
+                    self.sent(bucket, now)
+                    return
+                else:
+                    bucket['tokens'] = min(
+                        max(1.0, bucket['rate']),
+                        bucket['tokens'] + (now - bucket['updated']) * bucket['rate'])
+                    bucket['updated'] = now
+                    if bucket['tokens'] >= 1:
+                        bucket['tokens'] -= 1
+                        self.sent(bucket, now)
+                        return
+                    wait = (1 - bucket['tokens']) / bucket['rate']
+            sleep(wait)
+
+    def sent(self, bucket, now):
+        bucket['sent'].append(now)
+        while bucket['sent'][0] < now - RateLimiter.WINDOW:
+            bucket['sent'].popleft()
+
+    def observed_rate(self, bucket, now):
+        """Returns the requests per second recently sent to a host"""
+        sent = bucket['sent']
+        if not sent:
+            return RateLimiter.MIN_RATE
+        return len(sent) / max(1.0, now - sent[0])
+
+    def slow_down(self, host, delay):
+        """Halves the host rate and pauses all requests to it for delay seconds"""
+        with self.lock:
+            bucket = self.bucket(host)
+            now = time()
+            if not bucket['rate']:
+                # No configured rate, start from the one that got us throttled
+                bucket['ceiling'] = max(self.observed_rate(bucket, now),
+                                        RateLimiter.MIN_RATE)
+                bucket['rate'] = bucket['ceiling']
+                bucket['tokens'] = 0.0
+                bucket['updated'] = now
+            bucket['rate'] = max(bucket['rate'] / 2, RateLimiter.MIN_RATE)
+            bucket['blocked_until'] = max(bucket['blocked_until'], now + delay)
+
+    def speed_up(self, host):
+        with self.lock:
+            bucket = self.bucket(host)
+            if bucket['rate']:
+                bucket['rate'] = min(bucket['ceiling'],
+                                     bucket['rate'] + bucket['ceiling'] / 20.0)
+
+
+class RunMetrics(object):
+    """Calls, busy time and bytes of each phase of a run"""
+    def __init__(self):
+        self.started = time()
+        self.phases = OrderedDict()
+        self.lock = threading.Lock()
+
+    def phase(self, name):
+        if not name in self.phases:
+            self.phases[name] = {'calls': 0, 'seconds': 0.0, 'bytes': 0}
+        return self.phases[name]
+
+    def add(self, name, seconds=0.0, calls=0, bytes_count=0):
+        with self.lock:
+            phase = self.phase(name)
+            phase['calls'] += calls
+            phase['seconds'] += seconds
+            phase['bytes'] += bytes_count
+
+    @contextmanager
+    def timed(self, name):
+        start = time()
+        try:
+            yield
+        finally:
+            self.add(name, time() - start, calls=1)
+
+    def report(self, errors_count=None):
+        """Returns the metrics as a dict, busy time is summed over threads"""
+        elapsed = time() - self.started
+        with self.lock:
+            phases = OrderedDict()
+            for name, phase in self.phases.items():
+                phases[name] = dict(phase)
+                phases[name]['throughput'] = (
+                    phase['bytes'] / phase['seconds'] if phase['seconds'] else 0.0)
+        return OrderedDict([
+            ('started', self.started),
+            ('elapsed', elapsed),
+            ('phases', phases),
+            ('errors', dict(errors_count or {}))
+        ])
+
+    def write_json(self, file_name, errors_count=None):
+        with open(file_name + '.tmp', 'w') as filehandle:
+            json.dump(self.report(errors_count), filehandle, indent=4)
+        replace(file_name + '.tmp', file_name)
+
+    def write_prometheus(self, file_name, errors_count=None):
+        """Writes the metrics in the node_exporter textfile collector format"""
+        def label(value):
+            return (value.replace('\\', '\\\\').replace('"', '\\"')
+                    .replace('\n', '\\n'))
+        report = self.report(errors_count)
+        lines = [
+            '# HELP dagr_run_started_seconds Start time of the run.',
+            '# TYPE dagr_run_started_seconds gauge',
+            'dagr_run_started_seconds {:f}'.format(report['started']),
+            '# HELP dagr_run_elapsed_seconds Wall clock duration of the run.',
+            '# TYPE dagr_run_elapsed_seconds gauge',
+            'dagr_run_elapsed_seconds {:f}'.format(report['elapsed'])
+        ]
+        for key, help_text in (
+                ('calls', 'Number of times each phase ran.'),
+                ('seconds', 'Time spent in each phase, summed over threads.'),
+                ('bytes', 'Bytes transferred in each phase.')):
+            metric = 'dagr_phase_{}'.format(key)
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            lines.append('# TYPE {} gauge'.format(metric))
+            for name, phase in report['phases'].items():
+                lines.append('{}{{phase="{}"}} {}'.format(
+                    metric, label(name), phase[key]))
+        lines.append('# HELP dagr_errors Download errors of the run, by message.')
+        lines.append('# TYPE dagr_errors gauge')
+        for error, count in report['errors'].items():
+            lines.append('dagr_errors{{error="{}"}} {}'.format(label(error), count))
+        # The collector must never see a partially written file
+        with open(file_name + '.tmp', 'w') as filehandle:
+            filehandle.write('\n'.join(lines) + '\n')
+        replace(file_name + '.tmp', file_name)
+
+
+class RequestProfiler(object):
+    """Request latency histograms by type, with optional CPU profiling"""
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    KINDS = ('listing', 'deviation page', 'file', 'other')
+
+    def __init__(self, dump_file=None, slow_count=5):
+        self.dump_file = dump_file
+        self.slow_count = slow_count
+        self.latencies = dict((kind, []) for kind in RequestProfiler.KINDS)
+        self.slowest = dict((kind, []) for kind in RequestProfiler.KINDS)
+        self.profiles = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def requests_of(self, kind):
+        """Files the requests sent by the current thread under kind"""
+        previous = getattr(self.local, 'kind', None)
+        self.local.kind = kind
+        try:
+            yield
+        finally:
+            self.local.kind = previous
+
+    def record(self, url, seconds):
+        kind = getattr(self.local, 'kind', None) or 'other'
+        with self.lock:
+            self.latencies[kind].append(seconds)
+            if len(self.slowest[kind]) < self.slow_count:
+                heapq.heappush(self.slowest[kind], (seconds, url))
+            else:
+                heapq.heappushpop(self.slowest[kind], (seconds, url))
+
+    def start(self):
+        if not self.dump_file:
+            return
+        # cProfile only follows the thread enabling it, hook the others too
+        threading.setprofile(self.profile_thread)
+        self.profile_thread()
+
+    def profile_thread(self, *args):
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Newer Pythons profile every thread from the first one
+            return
+        with self.lock:
+            self.profiles.append(profile)
+
+    def stop(self):
+        if not self.dump_file:
+            return
+        threading.setprofile(None)
+        stats = None
+        for profile in self.profiles:
+            profile.disable()
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats:
+            stats.dump_stats(self.dump_file)
+            print('CPU profile written to ' + self.dump_file)
+            stats.sort_stats('tottime').print_stats(15)
+
+    def print_summary(self, metrics=None):
+        print('Request latencies:')
+        for kind in RequestProfiler.KINDS:
+            latencies = sorted(self.latencies[kind])
+            if not latencies:
+                continue
+            def percentile(fraction):
+                return latencies[int(fraction * (len(latencies) - 1))]
+            print('* {}: {} requests, mean {:.3f}s, p50 {:.3f}s, p90 {:.3f}s, '
+                  'p99 {:.3f}s, max {:.3f}s'.format(
+                      kind, len(latencies), sum(latencies) / len(latencies),
+                      percentile(0.5), percentile(0.9), percentile(0.99),
+                      latencies[-1]))
+            counts = [0] * (len(RequestProfiler.BUCKETS) + 1)
+            for latency in latencies:
+                bucket = 0
+                while (bucket < len(RequestProfiler.BUCKETS)
+                       and latency > RequestProfiler.BUCKETS[bucket]):
+                    bucket += 1
+                counts[bucket] += 1
+            labels = ['<= {}s'.format(x) for x in RequestProfiler.BUCKETS]
+            labels.append('>  {}s'.format(RequestProfiler.BUCKETS[-1]))
+            for label, count in zip(labels, counts):
+                if count:
+                    print('  {:>8} {:>7} {}'.format(
+                        label, count, '#' * max(1, 40 * count // len(latencies))))
+        slowest = []
+        for kind in RequestProfiler.KINDS:
+            slowest.extend((seconds, kind, url) for seconds, url in self.slowest[kind])
+        if slowest:
+            print('Slowest requests:')
+            for seconds, kind, url in sorted(slowest, reverse=True):
+                print('* {:.3f}s {} {}'.format(seconds, kind, url))
+        if metrics:
+            print('Time by phase, summed over threads:')
+            for name, phase in metrics.report()['phases'].items():
+                print('* {}: {} calls, {:.3f}s'.format(
+                    name, phase['calls'], phase['seconds']))
+
+
+def timed_phase(name):
+    """Decorates a Dagr method to add its calls and time to the run metrics"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timed(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled_requests(kind):
+    """Decorates a Dagr method to file the requests it sends under kind"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.profiler:
+                return method(self, *args, **kwargs)
+            with self.profiler.requests_of(kind):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ThrottledAdapter(req_adapters.HTTPAdapter):
+    """HTTPAdapter going through a RateLimiter, retrying throttled requests"""
+    THROTTLED_CODES = (req_codes.too_many_requests, req_codes.service_unavailable)
+
+    def __init__(self, limiter, throttle_retries=5, timeout=None,
+                 socket_options=None, profiler=None, *args, **kwargs):
+        self.limiter = limiter
+        self.profiler = profiler
+        self.throttle_retries = throttle_retries
+        self.timeout = timeout
+        self.socket_options = socket_options
+        super(ThrottledAdapter, self).__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.socket_options:
+            kwargs['socket_options'] = self.socket_options
+        super(ThrottledAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        # MechanicalSoup does not pass timeouts, use ours
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        host = urlparse(request.url).netloc
+        attempt = 0
+        while True:
+            self.limiter.acquire(host)
+            start = time()
+            response = super(ThrottledAdapter, self).send(request, *args, **kwargs)
+            if self.profiler:
+                self.profiler.record(request.url, time() - start)
+            if not response.status_code in ThrottledAdapter.THROTTLED_CODES:
+                self.limiter.speed_up(host)
+                return response
+            if attempt >= self.throttle_retries:
+                return response
+            retry_after = parse_retry_after(response.headers.get('retry-after'))
+            self.limiter.slow_down(host, max(retry_after or 0, backoff_delay(attempt)))
+            response.close()
+            attempt += 1
 
 
 class Dagr:
@@ -85,20 +775,58 @@ class Dagr:
     def __init__(self):
         # Internals
         self.init_mimetypes()
-        self.browser = None
+        self._local = threading.local()
+        self._browser = None
+        self.lock = threading.RLock()
         self.errors_count = dict()
+        self.metrics = RunMetrics()
 
         # Configuration
         self.directory = getcwd() + "/"
         self.mature = False
         self.overwrite = False
+        self.revalidate = False
         self.reverse = False
         self.test_only = False
         self.verbose = False
         self.save_progress = None
+        self.workers = 1
+        self.resolve_workers = None
+        self.download_workers = None
+        self.queue_size = None
+        self.page_window = 1
+        self.folder_workers = 1
+        self.incremental = None
+        self.listing_cache = None
+        self.listing_cache_ttl = 0
+        self.fast_parse = False
+        self.request_rate = None
+        self.pool_connections = None
+        self.pool_maxsize = None
+        self.connect_timeout = 150
+        self.read_timeout = 150
+        self.keep_alive = True
+        self.throttle_retries = 5
+        self.link_cache = None
+        self.link_cache_ttl = 3600
+        self.link_cache_size = 100000
+        self.dedup = False
+        self.content_index = None
+        self.manifest = None
+        self.planned_pages = {}
+        self.chunk_size = 1024 * 1024
         self.debug = False
         self.retry_exception_names = {}
         self.cache = CacheSettings()
+        self.cache_stores = {}
+        # Shared with forked rippers, one connection per database file
+        self.cache_databases = {}
+        self.deviants = None
+        self.report_file = None
+        self.prometheus_file = None
+        self.profile = False
+        self.profile_dump = None
+        self.profiler = None
 
         # Current status
         self.deviant = ""
@@ -133,6 +861,62 @@ class Dagr:
                 ) + "/"
         if my_conf.has_option("Dagr", "SaveProgress"):
             self.save_progress = my_conf.getint("Dagr", "SaveProgress")
+        if my_conf.has_option("Dagr", "Workers"):
+            self.workers = my_conf.getint("Dagr", "Workers")
+        if my_conf.has_option("Dagr", "ResolveWorkers"):
+            self.resolve_workers = my_conf.getint("Dagr", "ResolveWorkers")
+        if my_conf.has_option("Dagr", "DownloadWorkers"):
+            self.download_workers = my_conf.getint("Dagr", "DownloadWorkers")
+        if my_conf.has_option("Dagr", "QueueSize"):
+            self.queue_size = my_conf.getint("Dagr", "QueueSize")
+        if my_conf.has_option("Dagr", "PageWindow"):
+            self.page_window = my_conf.getint("Dagr", "PageWindow")
+        if my_conf.has_option("Dagr", "FolderWorkers"):
+            self.folder_workers = my_conf.getint("Dagr", "FolderWorkers")
+        if my_conf.has_option("Dagr", "ChunkSize"):
+            self.chunk_size = my_conf.getint("Dagr", "ChunkSize")
+        if my_conf.has_option("Dagr", "Incremental"):
+            self.incremental = my_conf.getint("Dagr", "Incremental")
+        if my_conf.has_option("Dagr", "ListingCache"):
+            self.listing_cache = expanduser(my_conf.get("Dagr", "ListingCache"))
+        if my_conf.has_option("Dagr", "ListingCacheTTL"):
+            self.listing_cache_ttl = my_conf.getint("Dagr", "ListingCacheTTL")
+        if my_conf.has_option("Dagr", "Revalidate"):
+            self.revalidate = my_conf.getboolean("Dagr", "Revalidate")
+        if my_conf.has_option("Dagr", "LinkCache"):
+            self.link_cache = expanduser(my_conf.get("Dagr", "LinkCache"))
+        if my_conf.has_option("Dagr", "LinkCacheTTL"):
+            self.link_cache_ttl = my_conf.getint("Dagr", "LinkCacheTTL")
+        if my_conf.has_option("Dagr", "LinkCacheSize"):
+            self.link_cache_size = my_conf.getint("Dagr", "LinkCacheSize")
+        if my_conf.has_option("Dagr", "Manifest"):
+            self.manifest = expanduser(my_conf.get("Dagr", "Manifest"))
+        if my_conf.has_option("Dagr", "Dedup"):
+            self.dedup = my_conf.getboolean("Dagr", "Dedup")
+        if my_conf.has_option("Dagr", "FastParse"):
+            self.fast_parse = my_conf.getboolean("Dagr", "FastParse")
+        if my_conf.has_option("Dagr", "RequestRate"):
+            self.request_rate = my_conf.getfloat("Dagr", "RequestRate")
+        if my_conf.has_option("Dagr", "ThrottleRetries"):
+            self.throttle_retries = my_conf.getint("Dagr", "ThrottleRetries")
+        if my_conf.has_option("Dagr", "PoolConnections"):
+            self.pool_connections = my_conf.getint("Dagr", "PoolConnections")
+        if my_conf.has_option("Dagr", "PoolMaxsize"):
+            self.pool_maxsize = my_conf.getint("Dagr", "PoolMaxsize")
+        if my_conf.has_option("Dagr", "ConnectTimeout"):
+            self.connect_timeout = my_conf.getfloat("Dagr", "ConnectTimeout")
+        if my_conf.has_option("Dagr", "ReadTimeout"):
+            self.read_timeout = my_conf.getfloat("Dagr", "ReadTimeout")
+        if my_conf.has_option("Dagr", "KeepAlive"):
+            self.keep_alive = my_conf.getboolean("Dagr", "KeepAlive")
+        if my_conf.has_option("Dagr", "Report"):
+            self.report_file = expanduser(my_conf.get("Dagr", "Report"))
+        if my_conf.has_option("Dagr", "PrometheusFile"):
+            self.prometheus_file = expanduser(my_conf.get("Dagr", "PrometheusFile"))
+        if my_conf.has_option("Dagr", "Profile"):
+            self.profile = my_conf.getboolean("Dagr", "Profile")
+        if my_conf.has_option("Dagr", "ProfileDump"):
+            self.profile_dump = expanduser(my_conf.get("Dagr", "ProfileDump"))
         if my_conf.has_option("Dagr", "Verbose"):
             self.verbose = my_conf.getboolean("Dagr", "Verbose")
         if my_conf.has_option("Dagr", "Debug"):
@@ -145,13 +929,71 @@ class Dagr:
             self.cache.artists = my_conf.get("Dagr.Cache", "Artists")
         if my_conf.has_option("Dagr.Cache", "Meta"):
             self.cache.meta = my_conf.get("Dagr.Cache", "Meta")
+        if my_conf.has_option("Dagr.Cache", "Backend"):
+            self.cache.backend = my_conf.get("Dagr.Cache", "Backend")
+        if my_conf.has_option("Dagr.Cache", "Database"):
+            self.cache.database = my_conf.get("Dagr.Cache", "Database")
+        if my_conf.has_option("Dagr.Cache", "Deviants"):
+            self.cache.deviants = my_conf.get("Dagr.Cache", "Deviants")
+        if my_conf.has_option("Dagr.Cache", "DeviantsTTL"):
+            self.cache.deviants_ttl = my_conf.getint("Dagr.Cache", "DeviantsTTL")
         if my_conf.has_option("Dagr.Cache", "IndexFile"):
             self.cache.index_file = my_conf.get("Dagr.Cache", "IndexFile")
 
+    def fork(self):
+        """Returns a ripper sharing settings and session, to run in another thread"""
+        ripper = copy(self)
+        ripper._local = threading.local()
+        ripper.errors_count = dict()
+        ripper.cache_stores = {}
+        ripper.deviant = ""
+        return ripper
+
+    @property
+    def browser(self):
+        browser = getattr(self._local, 'browser', None)
+        if browser is None and self._browser:
+            # Worker threads get their own page state over the shared session
+            browser = StatefulBrowser(
+                session=self._browser.session,
+                user_agent=self._browser.session.headers.get('User-agent'))
+            self._local.browser = browser
+        return browser
+
+    @browser.setter
+    def browser(self, browser):
+        self._browser = browser
+        self._local.browser = browser
+
     def start(self):
         if not self.browser:
             # Set up fake browser
             self.set_browser()
+        self.load_deviants()
+
+    def load_deviants(self):
+        with self.lock:
+            if self.deviants is None:
+                self.deviants = self.load_cache_file(
+                    self.directory, self.cache.deviants) or {}
+
+    def get_cached_deviant(self, deviant_name):
+        self.load_deviants()
+        with self.lock:
+            entry = self.deviants.get(deviant_name.lower())
+        if entry and time() - entry['resolved'] < self.cache.deviants_ttl:
+            return entry['deviant'], entry['group']
+
+    def cache_deviant(self, deviant_name, deviant, group):
+        full_path = path_join(self.directory, self.cache.deviants)
+        with self.lock:
+            self.deviants[deviant_name.lower()] = {
+                'deviant': deviant, 'group': group, 'resolved': time()
+            }
+            da_make_dirs(self.directory)
+            with open(full_path + '.tmp', 'w') as filehandle:
+                json.dump(self.deviants, filehandle, indent=4, sort_keys=True)
+            replace(full_path + '.tmp', full_path)
 
     def set_browser(self):
         user_agents = (
@@ -173,105 +1015,349 @@ class Dagr:
         session.headers.update({'Referer': 'https://www.deviantart.com/'})
         if self.mature:
             session.cookies.update({'agegate_state': '1'})
-        session.mount('https://', req_adapters.HTTPAdapter(max_retries=3))
+        if not self.keep_alive:
+            session.headers.update({'Connection': 'close'})
+            socket_options = None
+        else:
+            # Notice dead pooled connections instead of waiting on them
+            socket_options = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+        pool_connections, pool_maxsize = self.pool_sizes()
+        self.rate_limiter = RateLimiter(self.request_rate)
+        session.mount('https://', ThrottledAdapter(
+            self.rate_limiter, self.throttle_retries,
+            timeout=(self.connect_timeout, self.read_timeout),
+            socket_options=socket_options, profiler=self.profiler,
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+            # Throttled responses must reach the adapter to slow every worker
+            max_retries=Retry(total=3, read=False,
+                              respect_retry_after_header=False)))
 
         self.browser = StatefulBrowser(session=session,
                                        user_agent=choice(user_agents))
 
 
+    def pool_sizes(self):
+        """Returns the configured pool sizes, or ones fitting the worker count"""
+        resolvers = self.resolve_workers or self.workers
+        downloaders = self.download_workers or self.workers
+        threads = self.folder_workers * (resolvers + downloaders + self.page_window)
+        return (self.pool_connections or 10,
+                self.pool_maxsize or max(10, threads))
+
     def get_response(self, url, *args, **kwargs):
         if isinstance(url, Tag):
             if hasattr(url, 'attrs') and 'href' in url.attrs:
                 url = self.browser.absolute_url(url['href'])
-        return self.browser.session.get(url, timeout=150)
+        return self.browser.session.get(url,
+                                        timeout=(self.connect_timeout,
+                                                 self.read_timeout),
+                                        stream=kwargs.get('stream', False),
+                                        headers=kwargs.get('headers'))
 
     def response_get_content_type(self, response):
         if "content-type" in response.headers:
             return next(iter(response.headers.get("content-type").split(";")), None)
 
+    def handle_retry(self, tries, ex):
+        """Returns if ex may be retried, raises otherwise"""
+        if self.verbose:
+            traceback.print_exc()
+        except_name = type(ex).__name__
+        if except_name in self.retry_exception_names:
+            if not except_name in tries:
+                tries[except_name] = 0
+            tries[except_name] += 1
+            if tries[except_name]  < 3:
+                sleep(backoff_delay(tries[except_name]))
+                return
+            raise DagrException('Failed to get url: {}'.format(except_name))
+        raise ex
+
+    def check_response(self, response):
+        if not response.status_code in (req_codes.ok, req_codes.partial_content):
+            response.close()
+            raise DagrException("incorrect status code - " +
+                                str(response.status_code))
+
+    def partial_names(self, part_base):
+        part_name = path_join(dirname(part_base), '.' + basename(part_base) + '.part')
+        return part_name, part_name + '.json'
+
+    def discard_partial(self, part_base):
+        for name in self.partial_names(part_base):
+            if path_exists(name):
+                os_remove(name)
+
+    def load_partial_record(self, part_base):
+        part_name, record_name = self.partial_names(part_base)
+        if not path_exists(record_name):
+            return None
+        try:
+            with open(record_name, 'r') as filehandle:
+                record = json.load(filehandle)
+            record['offset'] = getsize(part_name)
+            return record
+        except (IOError, OSError, ValueError):
+            if self.verbose:
+                traceback.print_exc()
+            self.discard_partial(part_base)
+
+    def resume_headers(self, part_base):
+        """Returns headers continuing an interrupted download, if any"""
+        record = self.load_partial_record(part_base)
+        if not record:
+            return {}
+        validator = record.get('etag') or record.get('last_modified')
+        if not record['offset'] or not validator:
+            self.discard_partial(part_base)
+            return {}
+        return {'Range': 'bytes={}-'.format(record['offset']),
+                'If-Range': validator}
+
+    def resume_offset(self, response, part_base):
+        """Returns where a ranged response body starts, None if it is unusable"""
+        if response.status_code == req_codes.requested_range_not_satisfiable:
+            response.close()
+            self.discard_partial(part_base)
+            return None
+        if not response.status_code == req_codes.partial_content:
+            # Server ignored the range or the file changed, start over
+            return 0
+        record = self.load_partial_record(part_base) or {}
+        content_range = re.match(r'bytes (\d+)-',
+                                 response.headers.get('content-range', ''))
+        unchanged = all(
+            not record.get(key) or record.get(key) == response.headers.get(header)
+            for key, header in (('etag', 'etag'), ('last_modified', 'last-modified')))
+        if (content_range and unchanged
+                and int(content_range.group(1)) == record.get('offset')):
+            if self.verbose:
+                print('Resuming download at byte {}'.format(record['offset']))
+            return record['offset']
+        response.close()
+        self.discard_partial(part_base)
+        return None
+
+    def revalidate_headers(self, file_name, files_list):
+        """Returns headers asking for the file only if changed since downloaded"""
+        if not (self.overwrite and self.revalidate):
+            return {}
+        existing = files_list.find(basename(file_name))
+        if not existing:
+            return {}
+        existing = path_join(dirname(file_name), existing)
+        if not path_exists(existing):
+            return {}
+        # get() sets mtime with mktime, which reads the header time as local
+        mod_time = timegm(localtime(getmtime(existing)))
+        return {'If-Modified-Since': formatdate(mod_time, usegmt=True)}
+
+    def open_response(self, url, tries, part_base=None, headers=None):
+        """Requests url, continuing the partial download of part_base if any"""
+        while True:
+            range_headers = self.resume_headers(part_base) if part_base else {}
+            try:
+                response = self.get_response(url, stream=bool(part_base),
+                                             headers=dict(headers or {}, **range_headers))
+            except Exception as ex:
+                self.handle_retry(tries, ex)
+                continue
+            offset = self.resume_offset(response, part_base) if range_headers else 0
+            if offset is None:
+                continue
+            if not (response.status_code == req_codes.not_modified
+                    and headers and 'If-Modified-Since' in headers):
+                self.check_response(response)
+            return response, offset
 
     def get(self, url, file_name=None, files_list=None):
         if file_name and files_list is None:
             raise ValueError('files_list cannot be empty when file_name is specified')
         if (file_name and not self.overwrite):
-            glob_name = next((fn for fn in files_list if basename(file_name) in fn), None)
+            glob_name = files_list.find(basename(file_name))
             if glob_name:
                 print(glob_name, "exists - skipping")
                 return None
 
-        response = None
         tries = {}
-
-        while True:
-            try:
-                response = self.get_response(url)
-                break
-            except Exception as ex:
-                if self.verbose:
-                    traceback.print_exc()
-                except_name = type(ex).__name__
-                if except_name in self.retry_exception_names:
-                    if not except_name in tries:
-                        tries[except_name] = 0
-                    tries[except_name] += 1
-                    if tries[except_name]  < 3:
-                        continue
-                    raise DagrException('Failed to get url: {}'.format(except_name))
-                else:
-                    raise ex
-
-        if not response.status_code == req_codes.ok:
-            raise DagrException("incorrect status code - " +
-                                str(response.status_code))
+        part_base = abspath(file_name) if file_name else None
+        headers = self.revalidate_headers(file_name, files_list) if file_name else None
+        response, offset = self.open_response(url, tries, part_base, headers)
 
         if not file_name:
             return response.text
 
+        if response.status_code == req_codes.not_modified:
+            response.close()
+            print(file_name, "not modified - skipping")
+            return None
+
         content_type = self.response_get_content_type(response)
         if self.verbose:
             print(content_type)
         if not content_type:
+            response.close()
             raise DagrException('missing content-type')
         file_ext = guess_extension(content_type)
         if not file_ext:
+            response.close()
             raise DagrException('unknown content-type - ' + content_type)
         file_name += file_ext
         file_name = abspath(file_name)
         file_exists = path_exists(file_name)
 
         if file_exists and not self.overwrite:
-            files_list.append(basename(file_name))
+            response.close()
+            with self.lock:
+                files_list.append(basename(file_name))
             print(file_name, "exists - skipping")
             return None
 
         while True:
             try:
-                with open(file_name, "wb") as local_file:
-                    local_file.write(response.content)
+                if response is None:
+                    response, offset = self.open_response(url, tries, part_base)
+                self.write_response(response, file_name, part_base, offset)
                 break
             except Exception as ex:
-                if self.verbose:
-                    traceback.print_exc()
-                except_name = type(ex).__name__
-                if except_name in self.retry_exception_names:
-                    if not except_name in tries:
-                        tries[except_name] = 0
-                    tries[except_name] += 1
-                    if tries[except_name]  < 3:
-                        continue
-                    raise DagrException('Failed to get url: {}'.format(except_name))
-                else:
-                    raise ex
+                if response is not None:
+                    response.close()
+                    response = None
+                self.handle_retry(tries, ex)
 
         if response.headers.get("last-modified"):
             # Set file dates to last modified time
             mod_time = mktime(parsedate(response.headers.get("last-modified")))
             utime(file_name, (mod_time, mod_time))
 
-        files_list.append(basename(file_name))
+        with self.lock:
+            files_list.append(basename(file_name))
         return file_name
 
+    def write_response(self, response, file_name, part_base, offset=0):
+        """Streams the response body to a partial file, then moves it into place"""
+        part_name, record_name = self.partial_names(part_base)
+        if not offset:
+            record = {
+                'etag': response.headers.get('etag'),
+                'last_modified': response.headers.get('last-modified'),
+                'length': (None if response.headers.get('content-encoding')
+                           else response.headers.get('content-length'))
+            }
+            if record['etag'] or record['last_modified']:
+                with open(record_name, 'w') as filehandle:
+                    json.dump(record, filehandle)
+            elif path_exists(record_name):
+                os_remove(record_name)
+        written = 0
+        try:
+            with open(part_name, "ab" if offset else "wb") as local_file:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    local_file.write(chunk)
+                    written += len(chunk)
+        except:
+            # Keep what we got if the next run can resume from it
+            if not path_exists(record_name) and path_exists(part_name):
+                os_remove(part_name)
+            raise
+        finally:
+            response.close()
+            self.metrics.add('get', bytes_count=written)
+        record = self.load_partial_record(part_base)
+        if record and record.get('length') and int(record['length']) != record['offset']:
+            raise DagrException('incomplete download')
+        replace(part_name, file_name)
+        self.discard_partial(part_base)
+
+    def listing_cache_file(self, url):
+        # Listings differ with the mature content filter
+        key = sha1('{} {}'.format(self.mature, url).encode('utf-8')).hexdigest()
+        return path_join(self.listing_cache, key + '.json')
+
+    @profiled_requests('listing')
+    def get_listing(self, url):
+        """Returns a listing page, revalidating the locally cached copy if any"""
+        if not self.listing_cache:
+            return self.get(url)
+        cache_file = self.listing_cache_file(url)
+        entry = None
+        if path_exists(cache_file):
+            try:
+                with open(cache_file, 'r') as filehandle:
+                    entry = json.load(filehandle)
+            except (IOError, OSError, ValueError):
+                if self.verbose:
+                    traceback.print_exc()
+        if entry and self.listing_cache_ttl:
+            if time() - getmtime(cache_file) < self.listing_cache_ttl:
+                return entry['body']
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        tries = {}
+        while True:
+            try:
+                response = self.get_response(url, headers=headers)
+                break
+            except Exception as ex:
+                self.handle_retry(tries, ex)
+        if response.status_code == req_codes.not_modified and entry:
+            if self.verbose:
+                print('{} not modified'.format(url))
+            utime(cache_file, None)
+            return entry['body']
+        self.check_response(response)
+        entry = {
+            'url': url,
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'body': response.text
+        }
+        if entry['etag'] or entry['last_modified'] or self.listing_cache_ttl:
+            da_make_dirs(self.listing_cache)
+            temp_name = cache_file + '.' + threading.current_thread().name
+            with open(temp_name, 'w') as filehandle:
+                json.dump(entry, filehandle)
+            replace(temp_name, cache_file)
+        return entry['body']
+
+    def find_link_cached(self, link, refresh=False):
+        """Resolves link through the link cache, refresh skips the cached entry"""
+        if not self.link_cache:
+            return self.find_absolute_link(link)
+        with self.lock:
+            if not isinstance(self.link_cache, LinkCache):
+                self.link_cache = LinkCache(self.link_cache,
+                                            self.link_cache_ttl,
+                                            self.link_cache_size)
+        cached = None if refresh else self.link_cache.get(link)
+        if cached:
+            if self.verbose:
+                print("Using cached link for " + link)
+            return cached
+        filename, filelink, linkmeta = self.find_absolute_link(link)
+        self.link_cache.put(link, filename, filelink, linkmeta)
+        return filename, filelink, linkmeta
+
+    def find_absolute_link(self, link):
+        """Like find_link, with download links turned into absolute URLs
+
+        Relative links only make sense to the browser which opened the page,
+        so this has to run on the thread resolving it, not the downloader.
+        """
+        filename, filelink, linkmeta = self.find_link(link)
+        if isinstance(filelink, Tag):
+            filelink = self.browser.absolute_url(filelink['href'])
+        return filename, filelink, linkmeta
+
+    @timed_phase('find_link')
+    @profiled_requests('deviation page')
     def find_link(self, link):
+        if self.fast_parse:
+            return self.find_link_fast(link)
         filelink = None
         filename = basename(link)
         linkmeta = {}
@@ -355,14 +1441,157 @@ class Dagr:
 
         return (filename, filelink, linkmeta)
 
+    def parse_page(self, link):
+        """Fetches a deviation page, only parsing the elements find_link needs"""
+        response = self.get_response(link)
+        content_type = response.headers.get("Content-Type", "")
+        encoding = response.encoding if 'charset' in content_type else None
+        if not encoding:
+            encoding = EncodingDetector.find_declared_encoding(
+                response.content, is_html=True)
+        soup_config = dict(self.browser.soup_config, parse_only=FindLinkStrainer())
+        return response.url, BeautifulSoup(response.content,
+                                           from_encoding=encoding, **soup_config)
+
+    def find_link_fast(self, link):
+        """Same as find_link, with a restricted parse and a single walk of it"""
+        filelink = None
+        filename = basename(link)
+        linkmeta = {}
+        mature_error = False
+        page_url, current_page = self.parse_page(link)
+
+        link_text = re.compile("Download( (Image|File))?")
+        found = {}
+        titles = []
+        tags = []
+        for tag in current_page.find_all(True):
+            classes = tag.get('class') or []
+            if tag.name == 'a':
+                if 'title' in classes:
+                    titles.append(tag)
+                if 'discoverytag' in classes:
+                    tags.append(tag)
+                href = tag.get('href')
+                if (href and 'a' in href and not 'download' in found
+                        and link_text.search(tag.text)):
+                    found['download'] = tag
+                continue
+            if tag.name == 'div' and 'dev-description' in classes:
+                key = 'description'
+            elif tag.name == 'span' and 'cc-copy' in classes:
+                key = 'copyright'
+            elif tag.name == 'span' and 'dev-about-breadcrumb' in classes:
+                key = 'category'
+            elif tag.name == 'meta' and tag.get('property') == 'og:image':
+                key = 'og:image'
+            elif tag.name == 'img' and tag.has_attr('collect_rid') and classes:
+                if re.search('.*full', ' '.join(classes)):
+                    key = 'full'
+                elif re.search('.*normal', ' '.join(classes)):
+                    key = 'normal'
+                else:
+                    continue
+            elif tag.name == 'iframe' and 'flashtime' in classes:
+                key = 'iframe'
+            else:
+                key = None
+            if key and not key in found:
+                found[key] = tag
+            if (tag.name == 'span' and tag.get('itemprop') == 'title'
+                    and not 'page_title' in found):
+                found['page_title'] = tag
+
+        try:
+            linkmeta = {
+                'title': titles[0].text,
+                'tags': [x.attrs['data-canonical-tag'] for x in tags],
+                'description': str(found['description'].findChild()),
+                'copyright': found['copyright'].text,
+                'category': found['category'].text
+            }
+        except:
+            pass
+
+        img_link = found.get('download')
+        if img_link and img_link.get("data-download_url"):
+            # The browser did not open this page, resolve relative links here
+            img_link['href'] = urljoin(page_url, img_link['href'])
+            return (filename, img_link, linkmeta)
+
+        if self.verbose:
+            print("Download link not found, falling back to direct image")
+
+        # Fallback 1: try meta (filtering blocked meta)
+        filesearch = found.get('og:image')
+        if filesearch:
+            filelink = filesearch['content']
+            if basename(filelink).startswith("noentrythumb-"):
+                filelink = None
+                mature_error = True
+        if not filelink:
+            # Fallback 2 and 3: try collect_rid, full then normal
+            filesearch = found.get('full') or found.get('normal')
+            if filesearch:
+                filelink = filesearch['src']
+
+        page_title = found.get('page_title')
+        if page_title and page_title.text == "Literature":
+            return (filename, page_url, linkmeta)
+
+        if not filelink:
+           filelink = self.find_video(current_page)
+
+        if not filelink:
+            iframe_search = found.get('iframe')
+            if iframe_search:
+                self.browser.open(iframe_search.attrs['src'])
+                embed_search = self.browser.get_current_page().find(
+                    'embed', {'id': 'sandboxembed'})
+                if embed_search:
+                    filelink = embed_search.attrs['src']
+
+        if not filelink:
+            if mature_error:
+                if self.mature:
+                    raise DagrException("maybe not an image")
+                else:
+                    raise DagrException("maybe a mature deviation/" +
+                                        "not an image")
+            else:
+                raise DagrException("all attemps to find a link failed")
+
+        return (filename, filelink, linkmeta)
+
     def find_video(self, current_page):
         try:
             script = self.filter_page_scripts(current_page, 'deviantART.pageData=')
+        except StopIteration:
+            return None
+        page_data = self.extract_page_data(script)
+        if page_data is not None:
+            try:
+                sizes = page_data['film']['sizes']
+                if isinstance(sizes, dict):
+                    sizes = list(sizes.values())
+                return sizes[-1]['src']
+            except (KeyError, IndexError, TypeError):
+                return None
+        # Not plain JSON, fall back to parsing the whole script
+        try:
             best_res = self.extract_nested_assign(script,['deviantART.pageData', '"film"', '"sizes"'])[-1]
             return json.loads(str(self.extract_nested_assign(best_res, ['"src"'])))
         except (ImportError, StopIteration):
             pass
 
+    def extract_page_data(self, script):
+        """Decodes the object assigned to deviantART.pageData, None if not JSON"""
+        start = script.find('deviantART.pageData=') + len('deviantART.pageData=')
+        try:
+            return json.JSONDecoder().raw_decode(script[start:].lstrip())[0]
+        except ValueError:
+            return None
+
     def filter_page_scripts(self, current_page, filt):
         return next(content for content in
                     (script.get_text() for script in
@@ -401,40 +1630,82 @@ class Dagr:
         else:
             self.errors_count[error_string] = 1
 
-    def get_pages(self, mode, base_url):
-        pages = []
-        for i in range(0, int(Dagr.MAX_DEVIATIONS / 24), 24):
-            html = ""
-            url = base_url + str(i)
-
+    def crawl_pages(self, base_url, offsets):
+        """Yields (offset, html) in order, fetching up to page_window pages ahead"""
+        def fetch(offset):
             try:
-                html = self.get(url)
+                return self.get_listing(base_url + str(offset))
             except DagrException:
-                print("Could not find " + self.deviant + "'s " + mode)
-                return pages
-
-            prelim = re.findall(Dagr.ART_PATTERN, html,
-                                re.IGNORECASE | re.DOTALL)
-
-            for match in prelim:
-                if match not in pages:
-                    pages.append(match)
-
-            done = re.findall("(This section has no deviations yet!|"
-                              "This collection has no items yet!|"
-                              "Sorry, we found no relevant results.|"
-                              "Sorry, we don't have that many results.)",
-                              html, re.IGNORECASE | re.S)
+                return None
+        if self.page_window <= 1:
+            for offset in offsets:
+                yield offset, fetch(offset)
+            return
+        offsets = iter(offsets)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.page_window) as executor:
+            try:
+                while True:
+                    for offset in offsets:
+                        pending.append((offset, executor.submit(fetch, offset)))
+                        if len(pending) >= self.page_window:
+                            break
+                    if not pending:
+                        return
+                    offset, future = pending.popleft()
+                    yield offset, future.result()
+            finally:
+                # Speculative requests past the last page are discarded
+                for _, future in pending:
+                    future.cancel()
+
+    @timed_phase('get_pages')
+    def get_pages(self, mode, base_url, known_pages=None):
+        pages = DeviationSet()
+        known_run = 0
+        crawler = self.crawl_pages(base_url,
+                                   range(0, int(Dagr.MAX_DEVIATIONS / 24), 24))
+        try:
+            for i, html in crawler:
+                if html is None:
+                    print("Could not find " + self.deviant + "'s " + mode)
+                    return list(pages)
 
-            if done:
-                break
+                prelim = re.findall(Dagr.ART_PATTERN, html,
+                                    re.IGNORECASE | re.DOTALL)
 
-            progress_msg = '{} page {} crawled...'.format(mode, int(i / 24) + 1)
-            if mode == 'search':
-                print(progress_msg)
-            else:
-                print("{}'s {}". format(self.deviant, progress_msg))
+                for match in prelim:
+                    if match in pages:
+                        continue
+                    pages.add(match)
+                    if known_pages is not None and match in known_pages:
+                        known_run += 1
+                    else:
+                        known_run = 0
+
+                if self.incremental and known_run >= self.incremental:
+                    print("Found {} already downloaded deviations in a row, "
+                          "stopping crawl".format(known_run))
+                    break
+
+                done = re.findall("(This section has no deviations yet!|"
+                                  "This collection has no items yet!|"
+                                  "Sorry, we found no relevant results.|"
+                                  "Sorry, we don't have that many results.)",
+                                  html, re.IGNORECASE | re.S)
+
+                if done:
+                    break
+
+                progress_msg = '{} page {} crawled...'.format(mode, int(i / 24) + 1)
+                if mode == 'search':
+                    print(progress_msg)
+                else:
+                    print("{}'s {}". format(self.deviant, progress_msg))
+        finally:
+            crawler.close()
 
+        pages = list(pages)
         if not self.reverse:
             pages.reverse()
 
@@ -471,9 +1742,9 @@ class Dagr:
             if self.verbose:
                 print('Building filenames cache')
             files_list_raw = glob(path_join(base_dir, '*'))
-            return [basename(fn) for fn in files_list_raw]
+            return FilenameIndex(basename(fn) for fn in files_list_raw)
         def downloaded_pages():
-            return []
+            return DeviationSet()
         def artists():
             return {}
         def meta():
@@ -484,14 +1755,116 @@ class Dagr:
             'artists': artists,
             'meta': meta
         }
+        store = self.cache_store(base_dir)
         for cache_type, cache_file in kwargs.items():
+            if not cache_type in cache_defaults:
+                raise ValueError('Unkown cache type: {}'.format(cache_type))
+            if store and store.has(cache_type):
+                yield store.load(cache_type)
+                continue
             cache_contents = self.load_cache_file(base_dir, cache_file)
-            if cache_contents:
-                yield cache_contents
-            else:
-                if not cache_type in cache_defaults:
-                    raise ValueError('Unkown cache type: {}'.format(cache_type))
-                yield cache_defaults[cache_type]()
+            if cache_contents and cache_type == 'filenames':
+                cache_contents = FilenameIndex(cache_contents)
+            elif cache_contents and cache_type == 'downloaded_pages':
+                cache_contents = DeviationSet(cache_contents)
+            elif not cache_contents:
+                cache_contents = cache_defaults[cache_type]()
+            replayed = self.replay_cache_journal(base_dir, cache_file, cache_contents)
+            if store and cache_contents:
+                if path_exists(path_join(base_dir, cache_file)):
+                    print('Migrating {} cache to {}'.format(
+                        cache_file, self.cache.database))
+                self.update_cache(base_dir, cache_file, cache_contents)
+            elif replayed:
+                # Left over from an interrupted run, compact it now
+                self.update_cache(base_dir, cache_file, cache_contents)
+            yield cache_contents
+
+    def cache_store(self, base_dir):
+        """Returns the SQLite store for base_dir, None with the JSON backend"""
+        if self.cache.backend != 'sqlite':
+            return None
+        with self.lock:
+            if not base_dir in self.cache_stores:
+                database = expanduser(self.cache.database)
+                if not isabs(database):
+                    database = path_join(base_dir, database)
+                database = abspath(database)
+                if not database in self.cache_databases:
+                    self.cache_databases[database] = SQLiteCacheDatabase(database)
+                shared = self.cache_databases[database]
+                shared.users += 1
+                self.cache_stores[base_dir] = SQLiteCacheStore(shared, base_dir)
+            return self.cache_stores[base_dir]
+
+    def close_cache_store(self, base_dir):
+        with self.lock:
+            store = self.cache_stores.pop(base_dir, None)
+            if not store:
+                return
+            store.database.users -= 1
+            if store.database.users:
+                return
+            del self.cache_databases[store.database.path]
+        store.database.close()
+
+    def cache_type(self, cache_file):
+        return {
+            self.cache.file_names: 'filenames',
+            self.cache.downloaded_pages: 'downloaded_pages',
+            self.cache.artists: 'artists',
+            self.cache.meta: 'meta'
+        }[cache_file]
+
+    def cache_exists(self, base_dir, cache_file):
+        store = self.cache_store(base_dir)
+        if store:
+            return store.has(self.cache_type(cache_file))
+        return path_exists(path_join(base_dir, cache_file))
+
+    def replay_cache_journal(self, base_dir, cache_file, cache_contents):
+        """Applies journaled entries to cache_contents, returns their count"""
+        full_path = path_join(base_dir, cache_file + '.journal')
+        if not path_exists(full_path):
+            return 0
+        replayed = 0
+        try:
+            with open(full_path, 'r') as filehandle:
+                for line in filehandle:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn write from an interrupted run
+                        continue
+                    if isinstance(cache_contents, dict):
+                        cache_contents[entry[0]] = entry[1]
+                    elif isinstance(cache_contents, DeviationSet):
+                        cache_contents.add(entry)
+                    elif cache_contents.find(entry) != entry:
+                        cache_contents.append(entry)
+                    replayed += 1
+        except:
+            print('Unable to replay {} journal:'.format(cache_file))
+            if self.verbose:
+                traceback.print_exc()
+        return replayed
+
+    def get_known_pages(self, mode, mode_arg=None):
+        """Returns pages already downloaded to a directory, for incremental crawls"""
+        if not self.incremental:
+            return None
+        base_dir = self.get_base_dir(mode, mode_arg)
+        if not base_dir:
+            return None
+        store = self.cache_store(base_dir)
+        if store and store.has('downloaded_pages'):
+            known_pages = store.load('downloaded_pages')
+        else:
+            cache_file = self.cache.downloaded_pages
+            known_pages = DeviationSet(self.load_cache_file(base_dir, cache_file) or [])
+            self.replay_cache_journal(base_dir, cache_file, known_pages)
+        self.close_cache_store(base_dir)
+        return known_pages
 
     def get_base_dir(self, mode, mode_arg=None):
         if self.deviant:
@@ -512,67 +1885,329 @@ class Dagr:
     def get_images(self, mode, mode_arg, pages):
         base_dir = self.get_base_dir(mode, mode_arg)
         if base_dir:
-            try:
-                with portalocker.TemporaryFileLock(
-                    filename=path_join(base_dir, '.lock'),
-                    fail_when_locked = True
-                    ):
-                    #Load caches
-                    fn_cache =  self.cache.file_names
-                    dp_cache = self.cache.downloaded_pages
-                    m_cache = self.cache.meta
-                    files_list, existing_pages, meta = self.load_cache(base_dir,
-                        filenames = fn_cache,
-                        downloaded_pages = dp_cache,
-                        meta = m_cache
-                    )
-                    if not self.overwrite:
-                        pages = [x for x in pages if x not in existing_pages]
-                    print("Total deviations to download: " + str(len(pages)))
-                    for count, link in enumerate(pages, start=1):
-                        if self.save_progress and count % self.save_progress == 0:
-                            self.update_cache(base_dir, fn_cache,files_list)
-                            self.update_cache(base_dir, dp_cache, existing_pages)
-                            self.update_cache(base_dir, m_cache, meta)
+            self.rip_directory(base_dir, pages)
+
+    def rip_directory(self, base_dir, pages):
+        try:
+            with portalocker.TemporaryFileLock(
+                filename=path_join(base_dir, '.lock'),
+                fail_when_locked = True
+                ):
+                #Load caches
+                fn_cache =  self.cache.file_names
+                dp_cache = self.cache.downloaded_pages
+                m_cache = self.cache.meta
+                files_list, existing_pages, meta = self.load_cache(base_dir,
+                    filenames = fn_cache,
+                    downloaded_pages = dp_cache,
+                    meta = m_cache
+                )
+                if not self.overwrite:
+                    pages = [x for x in pages if x not in existing_pages]
+                print("Total deviations to download: " + str(len(pages)))
+                failed = set()
+                journaled_files = [len(files_list)]
+                new_pages = []
+                new_meta = []
+                def checkpoint():
+                    with self.lock:
+                        files_count = len(files_list)
+                        new_files = files_list[journaled_files[0]:files_count]
+                    try:
+                        self.append_cache_journal(base_dir, fn_cache, new_files)
+                        self.append_cache_journal(base_dir, dp_cache, new_pages)
+                        self.append_cache_journal(base_dir, m_cache, new_meta)
+                    except (sqlite3.Error, OSError):
+                        # Kept for the next checkpoint or the final save
+                        print('Unable to save progress of {}:'.format(base_dir))
                         if self.verbose:
-                            print("Downloading " + str(count) + " of " +
-                                str(len(pages)) + " ( " + link + " )")
-                        filename = ""
-                        filelink = ""
-                        linkmeta = {}
-                        try:
-                            filename, filelink, linkmeta = self.find_link(link)
-                            if self.test_only:
-                                print(filelink)
-                                continue
-                            self.get(filelink, path_join(base_dir, filename), files_list)
-                        except (KeyboardInterrupt, SystemExit):
-                            if pages:
-                                self.update_cache(base_dir, fn_cache,files_list)
-                                self.update_cache(base_dir, dp_cache, existing_pages)
-                                self.update_cache(base_dir, m_cache, meta)
-                            raise
-                        except DagrException as get_error:
-                            pages.remove(link)
+                            traceback.print_exc()
+                        return
+                    journaled_files[0] = files_count
+                    del new_pages[:]
+                    del new_meta[:]
+                results = self.process_indexed_pages(base_dir, pages, files_list)
+                try:
+                    for count, (link, result, get_error) in enumerate(results, start=1):
+                        if get_error:
+                            failed.add(link)
                             self.handle_download_error(link, get_error)
-                            continue
-                        else:
-                            if link not in existing_pages:
-                                existing_pages.append(link)
+                        elif result:
+                            filename, linkmeta = result
+                            existing_pages.add(link)
                             meta[filename] = linkmeta
-                    if pages or (not path_exists(path_join(base_dir, fn_cache)) and files_list):
-                        self.update_cache(base_dir, fn_cache, files_list)
-                    if pages:
-                        self.update_cache(base_dir, dp_cache, existing_pages)
-                    if pages or (
-                            not path_exists(path_join(base_dir, self.cache.artists))
-                            and existing_pages):
-                        self.update_artists(base_dir, existing_pages, files_list)
-                        self.update_cache(base_dir, m_cache, meta)
-            except (portalocker.exceptions.LockException,portalocker.exceptions.AlreadyLocked):
-                print('Skipping locked directory {}'.format(base_dir))
-            except PermissionError:
-                print('Unable to unlock {}'.format(base_dir))
+                            new_pages.append(link)
+                            new_meta.append([filename, linkmeta])
+                        if count % (self.save_progress or 1) == 0:
+                            checkpoint()
+                except (KeyboardInterrupt, SystemExit):
+                    results.close()
+                    checkpoint()
+                    raise
+                finally:
+                    results.close()
+                pages = [x for x in pages if x not in failed]
+                if pages or (not self.cache_exists(base_dir, fn_cache) and files_list):
+                    self.update_cache(base_dir, fn_cache, files_list)
+                if pages:
+                    self.update_cache(base_dir, dp_cache, existing_pages)
+                if pages or (
+                        not self.cache_exists(base_dir, self.cache.artists)
+                        and existing_pages):
+                    self.update_artists(base_dir, existing_pages, files_list)
+                    self.update_cache(base_dir, m_cache, meta)
+        except (portalocker.exceptions.LockException,portalocker.exceptions.AlreadyLocked):
+            print('Skipping locked directory {}'.format(base_dir))
+        except PermissionError:
+            print('Unable to unlock {}'.format(base_dir))
+        finally:
+            self.close_cache_store(base_dir)
+
+    def get_content_index(self):
+        if not self.dedup:
+            return None
+        with self.lock:
+            if self.content_index is None:
+                self.content_index = ContentIndex(
+                    path_join(self.directory, self.cache.index_file))
+        return self.content_index
+
+    def link_file(self, source, target):
+        """Hardlinks source as target, False if the file system cannot"""
+        try:
+            link(source, target)
+            return True
+        except (OSError, AttributeError, NotImplementedError):
+            return False
+
+    def process_indexed_pages(self, base_dir, pages, files_list):
+        """Like process_pages, linking deviations found in other directories first"""
+        index = self.get_content_index()
+        remaining = pages
+        if index and not self.overwrite and not self.test_only:
+            remaining = []
+            for link in pages:
+                result = self.link_indexed(index, base_dir, link, files_list)
+                if result:
+                    yield link, result, None
+                else:
+                    remaining.append(link)
+        results = self.process_pages(base_dir, remaining, files_list)
+        try:
+            for result in results:
+                yield result
+        finally:
+            results.close()
+
+    def link_indexed(self, index, base_dir, link, files_list):
+        for full_path, _, name, digest, size, linkmeta in index.find_deviation(link):
+            target = abspath(path_join(base_dir, basename(full_path)))
+            if not path_exists(target) and not self.link_file(full_path, target):
+                continue
+            if self.verbose:
+                print('Linked {} from {}'.format(target, full_path))
+            linkmeta = json.loads(linkmeta)
+            index.add(target, link, name, digest, size, linkmeta)
+            with self.lock:
+                files_list.append(basename(target))
+            return name, linkmeta
+
+    def index_file(self, file_name, link, name, linkmeta, downloaded=True):
+        """Adds a downloaded file to the index, linking it to a known copy if any"""
+        index = self.get_content_index()
+        # Files kept from earlier runs are only hashed once
+        if not index or (not downloaded and index.has(file_name)):
+            return
+        digest = ContentIndex.file_digest(file_name)
+        size = getsize(file_name)
+        duplicate = index.find_content(digest, size)
+        if duplicate and duplicate[0] != file_name:
+            # Same bytes under another deviation, keep a single copy on disk
+            temp_name = file_name + '.dedup'
+            if self.link_file(duplicate[0], temp_name):
+                replace(temp_name, file_name)
+        index.add(file_name, link, name, digest, size, linkmeta)
+
+    def process_pages(self, base_dir, pages, files_list):
+        """Yields (link, result, error) for each page, as downloads complete"""
+        resolvers = self.resolve_workers or self.workers
+        downloaders = self.download_workers or self.workers
+        if max(resolvers, downloaders) <= 1:
+            for count, link in enumerate(pages, start=1):
+                try:
+                    item = self.resolve_page(base_dir, count, len(pages), link)
+                    if item:
+                        yield link, self.download_page(base_dir, link, item, files_list), None
+                    else:
+                        yield link, None, None
+                except DagrException as get_error:
+                    yield link, None, get_error
+            return
+
+        # Resolvers feed downloaders, each stage blocks on its own bounded queue
+        queue_size = self.queue_size or 2 * max(resolvers, downloaders)
+        link_queue = queue.Queue(maxsize=queue_size)
+        file_queue = queue.Queue(maxsize=queue_size)
+        result_queue = queue.Queue()
+        stop = threading.Event()
+        resolvers_left = [resolvers]
+
+        def put(dest_queue, item):
+            while not stop.is_set():
+                try:
+                    dest_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def take(src_queue):
+            while not stop.is_set():
+                try:
+                    return src_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        def feed():
+            for count, link in enumerate(pages, start=1):
+                if not put(link_queue, (count, link)):
+                    return
+            for _ in range(resolvers):
+                put(link_queue, None)
+
+        def resolve():
+            while True:
+                task = take(link_queue)
+                if not task:
+                    break
+                count, link = task
+                try:
+                    item = self.resolve_page(base_dir, count, len(pages), link)
+                except BaseException as get_error:
+                    result_queue.put((link, None, get_error))
+                    continue
+                if item:
+                    put(file_queue, (link, item))
+                else:
+                    result_queue.put((link, None, None))
+            with self.lock:
+                resolvers_left[0] -= 1
+                if resolvers_left[0]:
+                    return
+            for _ in range(downloaders):
+                put(file_queue, None)
+
+        def download():
+            while True:
+                task = take(file_queue)
+                if not task:
+                    break
+                link, item = task
+                try:
+                    result_queue.put(
+                        (link, self.download_page(base_dir, link, item, files_list), None))
+                except BaseException as get_error:
+                    result_queue.put((link, None, get_error))
+
+        threads = [threading.Thread(target=feed)]
+        threads += [threading.Thread(target=resolve) for _ in range(resolvers)]
+        threads += [threading.Thread(target=download) for _ in range(downloaders)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for _ in pages:
+                link, result, get_error = result_queue.get()
+                if get_error and not isinstance(get_error, DagrException):
+                    raise get_error
+                yield link, result, get_error
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def resolve_page(self, base_dir, count, total, link):
+        if self.verbose:
+            print("Downloading " + str(count) + " of " +
+                str(total) + " ( " + link + " )")
+        if link in self.planned_pages:
+            return self.planned_pages[link]
+        filename, filelink, linkmeta = self.find_link_cached(link)
+        if self.test_only:
+            print(filelink)
+            if self.manifest:
+                self.plan_page(base_dir, link, filename, filelink, linkmeta)
+            return None
+        return filename, filelink, linkmeta
+
+    def plan_page(self, base_dir, link, filename, filelink, linkmeta):
+        entry = {
+            'page': link,
+            'file': filelink,
+            'directory': relpath(base_dir, self.directory),
+            'filename': filename,
+            'meta': linkmeta
+        }
+        with self.lock:
+            with open(self.manifest, 'a') as filehandle:
+                filehandle.write(json.dumps(entry, sort_keys=True) + '\n')
+
+    def load_manifest(self, manifest_file):
+        """Returns the planned entries of a manifest by directory, last plan winning"""
+        directories = OrderedDict()
+        with open(manifest_file, 'r') as filehandle:
+            for line in filehandle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Planning was interrupted halfway through this line
+                    continue
+                directory = directories.setdefault(entry['directory'], OrderedDict())
+                directory[entry['page']] = entry
+        return directories
+
+    def execute_manifest(self, manifest_file):
+        """Downloads the files planned in a manifest, skipping those already done"""
+        directories = self.load_manifest(manifest_file)
+        for directory, entries in directories.items():
+            base_dir = path_join(self.directory, directory)
+            print("Downloading {} planned deviations to {}".format(
+                len(entries), base_dir))
+            try:
+                da_make_dirs(base_dir)
+            except OSError as mkdir_error:
+                print(str(mkdir_error))
+                continue
+            self.planned_pages = dict(
+                (link, (entry['filename'], entry['file'], entry['meta']))
+                for link, entry in entries.items())
+            try:
+                self.rip_directory(base_dir, list(entries))
+            finally:
+                self.planned_pages = {}
+        print("Manifest successfully executed.")
+
+    @timed_phase('get')
+    @profiled_requests('file')
+    def download_page(self, base_dir, link, item, files_list):
+        filename, filelink, linkmeta = item
+        try:
+            downloaded = self.get(filelink, path_join(base_dir, filename), files_list)
+        except DagrException as get_error:
+            if not link in self.planned_pages:
+                raise
+            # Planned download URLs expire, ask the deviation page again
+            print("Planned download of {} failed ({}), resolving it again".format(
+                link, get_error))
+            # The cached entry holds the URL that just failed
+            filename, filelink, linkmeta = self.find_link_cached(link, refresh=True)
+            downloaded = self.get(filelink, path_join(base_dir, filename), files_list)
+        if self.dedup:
+            real_filename = files_list.find(filename)
+            if real_filename:
+                self.index_file(abspath(path_join(base_dir, real_filename)),
+                                link, filename, linkmeta, bool(downloaded))
+        return filename, linkmeta
 
     def backup_cache_file(self, file_name):
         backup_name = file_name + '.bak'
@@ -581,13 +2216,36 @@ class Dagr:
                 os_remove(backup_name)
             rename(file_name, backup_name)
 
+    @timed_phase('update_cache')
     def update_cache(self, base_dir, cache_file, cache_contents):
+        store = self.cache_store(base_dir)
+        if store:
+            if self.verbose:
+                print('Updating {} cache'.format(cache_file))
+            store.save(self.cache_type(cache_file), cache_contents)
+            return
         full_path = path_join(base_dir, cache_file)
         self.backup_cache_file(full_path)
         if self.verbose:
             print('Updating {} cache'.format(cache_file))
         with open(full_path, 'w') as filehandle:
-            json.dump(cache_contents, filehandle, indent=4, sort_keys=True)
+            json.dump(cache_contents, filehandle, indent=4, sort_keys=True,
+                      default=list)
+        # The snapshot now holds everything journaled so far
+        if path_exists(full_path + '.journal'):
+            os_remove(full_path + '.journal')
+
+    @timed_phase('cache_journal')
+    def append_cache_journal(self, base_dir, cache_file, entries):
+        if not entries:
+            return
+        store = self.cache_store(base_dir)
+        if store:
+            store.append(self.cache_type(cache_file), entries)
+            return
+        with open(path_join(base_dir, cache_file + '.journal'), 'a') as filehandle:
+            for entry in entries:
+                filehandle.write(json.dumps(entry) + '\n')
 
     def update_artists(self, base_dir, pages, files_list):
         artists = {}
@@ -595,11 +2253,10 @@ class Dagr:
                 artist_url = dirname(dirname(page))
                 artist_name = basename(artist_url)
                 url_basename = basename(page)
-                try:
-                    real_filename = next(fn for fn in files_list if url_basename in fn)
-                except StopIteration as ex:
+                real_filename = files_list.find(url_basename)
+                if not real_filename:
                     print(page, url_basename)
-                    raise ex
+                    raise DagrException('missing file for ' + page)
                 if not artist_name in artists:
                     artists[artist_name] = {'Home Page': artist_url, 'Artworks':{}}
                 artists[artist_name]['Artworks'][real_filename] = page
@@ -607,7 +2264,8 @@ class Dagr:
 
     def global_search(self, query):
         base_url = 'https://www.deviantart.com/?q=' + query  + '&offset='
-        pages = self.get_pages('search', base_url)
+        pages = self.get_pages('search', base_url,
+                               self.get_known_pages('search', query))
         if not pages:
             print('No search results for query {}'.format(query))
             return
@@ -635,7 +2293,8 @@ class Dagr:
         elif mode == "category":
             base_url += "gallery/?catpath=" + mode_arg + "&offset="
 
-        pages = self.get_pages(mode, base_url)
+        pages = self.get_pages(mode, base_url,
+                               self.get_known_pages(mode, mode_arg))
         if not pages:
             print(self.deviant + "'s " + mode + " had no deviations.")
             return
@@ -655,50 +2314,93 @@ class Dagr:
         elif mode == "gallery":
             base_url += "gallery/"
 
-        folders = []
-
-        i = 0
-        while True:
-            html = self.get(base_url + '?offset=' + str(i))
-            k = re.findall('class="ch-top" href="' + base_url +
-                           '([0-9]*/[a-zA-Z0-9_-]*)"',
-                           html, re.IGNORECASE)
-            if k == []:
-                break
-
-            new_folder = False
-            for match in k:
-                if match not in folders:
-                    folders.append(match)
-                    new_folder = True
-            if not new_folder:
-                break
-            i += 10
+        folders = self.get_folders(base_url)
+        if self.reverse:
+            folders = list(folders)
+            folders.reverse()
 
-        # no repeats
-        folders = list(set(folders))
+        folder_count = self.crawl_folders(mode, base_url, folders)
 
-        if not folders:
+        if not folder_count:
             print(self.deviant + "'s " + mode + " is empty.")
 
         print("Total folders in " + self.deviant + "'s " +
-              mode + " found: " + str(len(folders)))
+              mode + " found: " + str(folder_count))
 
-        if self.reverse:
-            folders.reverse()
+        print(self.deviant + "'s " + mode + " successfully ripped.")
 
-        pages = []
-        for folder in folders:
-            label = folder.split("/")[-1]
-            print("Crawling folder " + label + "...")
-            pages = self.get_pages(mode, base_url + folder + '?offset=')
+    def get_folders(self, base_url):
+        """Yields each folder of a group once, as listing pages are crawled"""
+        folders = set()
+        crawler = self.crawl_pages(base_url + '?offset=',
+                                   range(0, int(Dagr.MAX_DEVIATIONS / 10), 10))
+        try:
+            for _, html in crawler:
+                if html is None:
+                    break
+                k = re.findall('class="ch-top" href="' + base_url +
+                               '([0-9]*/[a-zA-Z0-9_-]*)"',
+                               html, re.IGNORECASE)
+                new_folder = False
+                for match in k:
+                    if match not in folders:
+                        folders.add(match)
+                        new_folder = True
+                        yield match
+                if not new_folder:
+                    break
+        finally:
+            crawler.close()
+
+    def crawl_folders(self, mode, base_url, folders):
+        """Rips folders as they are found, up to folder_workers at once"""
+        if self.folder_workers <= 1:
+            folder_count = 0
+            for folder in folders:
+                self.folder_get(mode, base_url, folder)
+                folder_count += 1
+            return folder_count
+
+        # Each folder gets its own ripper, so caches and status stay apart
+        def folder_get(folder):
+            ripper = self.fork()
+            ripper.deviant = self.deviant
+            ripper.folder_get(mode, base_url, folder)
+            return ripper.errors_count
+
+        folder_count = 0
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.folder_workers) as executor:
+            try:
+                for folder in folders:
+                    if len(pending) >= self.folder_workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self.merge_errors(future.result())
+                    pending.add(executor.submit(folder_get, folder))
+                    folder_count += 1
+                for future in pending:
+                    self.merge_errors(future.result())
+            finally:
+                for future in pending:
+                    future.cancel()
+        return folder_count
+
+    def folder_get(self, mode, base_url, folder):
+        label = folder.split("/")[-1]
+        print("Crawling folder " + label + "...")
+        pages = self.get_pages(mode, base_url + folder + '?offset=',
+                               self.get_known_pages(mode, label))
 
-            if not self.reverse:
-                pages.reverse()
+        if not self.reverse:
+            pages.reverse()
 
-            self.get_images(mode, label, pages)
+        self.get_images(mode, label, pages)
 
-        print(self.deviant + "'s " + mode + " successfully ripped.")
+    def merge_errors(self, errors_count):
+        with self.lock:
+            for error, count in errors_count.items():
+                self.errors_count[error] = self.errors_count.get(error, 0) + count
 
     def print_errors(self):
         if self.errors_count:
@@ -706,11 +2408,28 @@ class Dagr:
             for error in self.errors_count:
                 print("* " + error + " : " + str(self.errors_count[error]))
 
+    def start_profile(self):
+        """Starts profiling requests, must run before the browser is set up"""
+        if self.profile or self.profile_dump:
+            self.profiler = RequestProfiler(self.profile_dump)
+            self.profiler.start()
+
+    def stop_profile(self):
+        if self.profiler:
+            self.profiler.stop()
+            self.profiler.print_summary(self.metrics)
+
+    def write_report(self):
+        if self.report_file:
+            self.metrics.write_json(self.report_file, self.errors_count)
+        if self.prometheus_file:
+            self.metrics.write_prometheus(self.prometheus_file, self.errors_count)
+
 
 def print_help():
     print(Dagr.NAME + " v" + Dagr.__version__ + " - deviantArt gallery ripper")
     print("Usage: " + Dagr.NAME +
-          " [-d directory] " + "[-fgmhorstv] " +
+          " [-d directory] " + "[-fgmhorstv] " + "[-w workers] " +
           "[-q query_text] [-c collection_id/collection_name] " +
           "[-a album_id/album_name] " +
           "[-k category] " +
@@ -747,16 +2466,68 @@ downloads artwork matching specified query string
 downloads artwork matching a category (value in catpath in URL)
 -t, --test
 skips the actual downloads, just prints URLs
+--manifest=FILE
+with --test, also append what would be downloaded to FILE
+--execute=FILE
+download everything planned in FILE by a --manifest run, instead of ripping
+ deviants, running it again carries on where it stopped
 -h, --help
 prints help and exits (this text)
 -r, --reverse
 download oldest deviations first
 -o, --overwrite
 redownloads a file even if it already exists
+--revalidate
+with --overwrite, only redownloads files changed on the server
 -v, --verbose
 outputs detailed information on downloads
 -p, --progress=COUNT
-save image cache after every COUNT downloads
+journal image cache after every COUNT downloads, default is after each one
+-i, --incremental=COUNT
+stop crawling after COUNT already downloaded deviations in a row
+-l, --page-window=COUNT
+fetch up to COUNT listing pages at once, default is 1
+--folder-workers=COUNT
+rip up to COUNT folders of a group at once, default is 1
+-w, --workers=COUNT
+download COUNT deviations at once, default is 1
+--resolve-workers=COUNT
+number of deviation pages to resolve at once, default is --workers
+--download-workers=COUNT
+number of files to download at once, default is --workers
+--queue-size=COUNT
+resolved deviations waiting for a download worker before resolving pauses
+--chunk-size=BYTES
+size of the blocks downloaded files are written in, default is 1048576
+--rate=REQUESTS
+send at most REQUESTS requests per second to each host, default is no limit
+--pool-size=COUNT
+keep up to COUNT connections per host, default fits the number of workers
+--pool-connections=COUNT
+keep connection pools for up to COUNT hosts, default is 10
+--connect-timeout=SECONDS
+--read-timeout=SECONDS
+give up on connections or reads taking longer, default is 150
+--no-keep-alive
+open a new connection for every request
+--fast-parse
+only parse the parts of deviation pages used to find download links
+--listing-cache=PATH
+keep listing pages in PATH and only download them again when changed
+--link-cache=FILE
+remember resolved deviation pages in database FILE, for an hour by default
+--dedup
+hardlink deviations already downloaded to another directory instead of
+ downloading them again, and identical files to each other
+--report=FILE
+write time, calls and bytes of each phase of the run to FILE as JSON
+--prometheus=FILE
+write the same metrics to FILE for the node_exporter textfile collector
+--profile
+print latency histograms of listing, deviation page, file and other
+ requests, and the slowest requests, when done
+--profile-dump=FILE
+also save a CPU profile of the run to FILE (pstats format), implies --profile
 
 Proxies:
  you can also configure proxies by setting the environment variables
@@ -767,6 +2538,9 @@ $ export HTTPS_PROXY="http://10.10.1.10:1080"
 """)
 
 def get_deviant(ripper, deviant_name):
+    cached = ripper.get_cached_deviant(deviant_name)
+    if cached:
+        return cached
     group = False
     html = ripper.get('https://www.deviantart.com/' + deviant_name + '/')
     deviant = re.search(r'<title>.[A-Za-z0-9-]*', html,
@@ -774,22 +2548,39 @@ def get_deviant(ripper, deviant_name):
     deviant = re.sub('[^a-zA-Z0-9_-]+', '', deviant)
     if re.search('<dt class="f h">Group</dt>', html):
         group = True
+    ripper.cache_deviant(deviant_name, deviant, group)
     return deviant, group
 
+def resolve_deviants(ripper, deviant_names):
+    """Resolves deviant names in parallel, filling the deviants cache"""
+    def resolve(deviant_name):
+        try:
+            get_deviant(ripper, deviant_name)
+        except DagrException:
+            pass
+    with ThreadPoolExecutor(max_workers=max(1, ripper.workers)) as executor:
+        list(executor.map(resolve, set(deviant_names)))
+
 def main():
     gallery = scraps = favs = False
     collection = album = query = category = ""
+    manifest = None
 
     if len(sys.argv) <= 1:
         print_help()
         sys.exit()
 
-    g_opts = "d:mu:p:a:q:k:p:c:vfgshrto"
+    g_opts = "d:mu:p:a:q:k:p:c:w:l:i:vfgshrto"
     g_long_opts = ['directory=', 'mature',
                     'album=', 'query=', 'collection=',
                     'verbose', 'favs', 'gallery', 'scraps',
-                    'help', 'reverse', 'test', 'overwrite',
-                    'category', 'progress']
+                    'help', 'reverse', 'test', 'overwrite', 'revalidate',
+                    'category', 'progress', 'workers=', 'page-window=', 'incremental=',
+                    'folder-workers=', 'resolve-workers=', 'download-workers=', 'queue-size=',
+                    'chunk-size=', 'rate=', 'pool-size=', 'pool-connections=', 'connect-timeout=',
+                    'read-timeout=', 'no-keep-alive', 'fast-parse', 'listing-cache=', 'link-cache=', 'dedup',
+                    'manifest=', 'execute=',
+                    'report=', 'prometheus=', 'profile', 'profile-dump=']
     try:
         options, deviants = gnu_getopt(sys.argv[1:], g_opts, g_long_opts)
     except GetoptError as err:
@@ -828,12 +2619,71 @@ def main():
             ripper.test_only = True
         elif opt in ('-o', '--overwrite'):
             ripper.overwrite = True
+        elif opt == '--revalidate':
+            ripper.revalidate = True
         elif opt in ('-p', '--progress'):
             if arg:
                 ripper.save_progress = int(arg)
-
-    run_ripper(ripper, deviants, gallery, scraps, favs, collection, album, query, category)
+        elif opt in ('-w', '--workers'):
+            ripper.workers = int(arg)
+        elif opt in ('-i', '--incremental'):
+            ripper.incremental = int(arg)
+        elif opt in ('-l', '--page-window'):
+            ripper.page_window = int(arg)
+        elif opt == '--folder-workers':
+            ripper.folder_workers = int(arg)
+        elif opt == '--resolve-workers':
+            ripper.resolve_workers = int(arg)
+        elif opt == '--download-workers':
+            ripper.download_workers = int(arg)
+        elif opt == '--queue-size':
+            ripper.queue_size = int(arg)
+        elif opt == '--chunk-size':
+            ripper.chunk_size = int(arg)
+        elif opt == '--rate':
+            ripper.request_rate = float(arg)
+        elif opt == '--pool-size':
+            ripper.pool_maxsize = int(arg)
+        elif opt == '--pool-connections':
+            ripper.pool_connections = int(arg)
+        elif opt == '--connect-timeout':
+            ripper.connect_timeout = float(arg)
+        elif opt == '--read-timeout':
+            ripper.read_timeout = float(arg)
+        elif opt == '--no-keep-alive':
+            ripper.keep_alive = False
+        elif opt == '--fast-parse':
+            ripper.fast_parse = True
+        elif opt == '--listing-cache':
+            ripper.listing_cache = abspath(expanduser(arg))
+        elif opt == '--link-cache':
+            ripper.link_cache = abspath(expanduser(arg))
+        elif opt == '--manifest':
+            ripper.manifest = abspath(expanduser(arg))
+        elif opt == '--execute':
+            manifest = abspath(expanduser(arg))
+        elif opt == '--dedup':
+            ripper.dedup = True
+        elif opt == '--report':
+            ripper.report_file = abspath(expanduser(arg))
+        elif opt == '--prometheus':
+            ripper.prometheus_file = abspath(expanduser(arg))
+        elif opt == '--profile':
+            ripper.profile = True
+        elif opt == '--profile-dump':
+            ripper.profile_dump = abspath(expanduser(arg))
+
+    ripper.start_profile()
+    try:
+        if manifest:
+            ripper.start()
+            ripper.execute_manifest(manifest)
+        else:
+            run_ripper(ripper, deviants, gallery, scraps, favs, collection, album, query, category)
+    finally:
+        ripper.stop_profile()
     ripper.print_errors()
+    ripper.write_report()
 
 
 def run_ripper(ripper, deviants, galleries=False, scraps=False, favs=False, collections=None, albums=None, queries=None, categories=None):
@@ -847,6 +2697,8 @@ def run_ripper(ripper, deviants, galleries=False, scraps=False, favs=False, coll
 
     # Only start when needed
     ripper.start()
+    if len(deviants) > 1:
+        resolve_deviants(ripper, deviants)
 
     for deviant in deviants:
         try:
@@ -860,9 +2712,10 @@ def run_ripper(ripper, deviants, galleries=False, scraps=False, favs=False, coll
             print("Current deviant: " + deviant)
         try:
             da_make_dirs(ripper.directory + deviant)
-        except OSError:
+        except OSError as mkdir_error:
+            print("Skipping " + deviant + ": " + str(mkdir_error))
             if ripper.verbose:
-                traceback.print_exec()
+                traceback.print_exc()
             continue
 
         ripper.deviant = deviant
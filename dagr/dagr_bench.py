@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Offline throughput benchmark for dagr
+# Serves synthetic galleries from a local stand-in for deviantArt, then
+# times deviant_get, group_get and global_search against it.
+
+import dagr, json, re, shutil, sys, tempfile, threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from getopt import gnu_getopt, GetoptError
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from multiprocessing import get_context
+from os import devnull
+from socketserver import ThreadingMixIn
+from time import sleep, time
+from requests.compat import urlsplit
+from urllib3 import PoolManager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+SCENARIOS = ('deviant', 'group', 'search')
+DEVIANT = 'BenchArtist'
+GROUP = 'BenchGroup'
+QUERY = 'bench'
+FILES_HOST = 'images.dagr-bench.invalid'
+
+
+class BenchConfig():
+    def __init__(self):
+        self.deviations = 240
+        self.folders = 8
+        self.folder_deviations = 30
+        self.results = 240
+        self.file_size = 256 * 1024
+        self.latency = 0.02
+        self.file_latency = 0.05
+        self.scenarios = SCENARIOS
+        self.json_file = None
+        self.keep = False
+        self.verbose = False
+
+
+class SyntheticGallery(object):
+    """Generates the pages and files of the stand-in site, counting them"""
+    def __init__(self, config):
+        self.config = config
+        self.counts = {'listing': 0, 'page': 0, 'file': 0, 'bytes': 0}
+        self.lock = threading.Lock()
+
+    def count(self, kind, bytes_count=0):
+        with self.lock:
+            self.counts[kind] += 1
+            self.counts['bytes'] += bytes_count
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def deviation_url(self, author, deviation_id):
+        return 'https://www.deviantart.com/{}/art/bench-{}'.format(
+            author.lower(), deviation_id)
+
+    def listing(self, author, first_id, total, offset, per_page, end_text):
+        ids = range(offset, min(offset + per_page, total))
+        if not ids:
+            return end_text
+        return '\n'.join('<a href="{}">deviation</a>'.format(
+            self.deviation_url(author, first_id + i)) for i in ids)
+
+    def profile(self, name):
+        html = '<title>{} on DeviantArt</title>'.format(name)
+        if name.lower() == GROUP.lower():
+            html += '<dt class="f h">Group</dt>'
+        return html
+
+    def folder_listing(self, offset):
+        base_url = 'https://www.deviantart.com/{}/gallery/'.format(GROUP.lower())
+        return '\n'.join(
+            '<a class="ch-top" href="{}{}/folder-{}">folder</a>'.format(
+                base_url, 1000 + i, i)
+            for i in range(offset, min(offset + 10, self.config.folders)))
+
+    def deviation(self, deviation_id):
+        """Alternates between the download link, og:image and video cases"""
+        file_url = 'https://{}/f/{}'.format(FILES_HOST, deviation_id)
+        html = ('<html><head>{head}</head><body>'
+                '<a class="title">Deviation {id}</a>'
+                '<a class="discoverytag" data-canonical-tag="bench">#bench</a>'
+                '<div class="dev-description"><p>Synthetic</p></div>'
+                '<span class="cc-copy">(c) bench</span>'
+                '<span class="dev-about-breadcrumb">Bench</span>'
+                '{body}</body></html>')
+        kind = deviation_id % 3
+        if kind == 0:
+            return html.format(id=deviation_id, head='', body=(
+                '<a class="dev-page-download" href="{}.png" data-download_url="1">'
+                'Download Image</a>'.format(file_url)))
+        if kind == 1:
+            return html.format(id=deviation_id, body='', head=(
+                '<meta property="og:image" content="{}.jpg">'.format(file_url)))
+        page_data = {'film': {'sizes': [{'src': file_url + '-360.mp4'},
+                                        {'src': file_url + '.mp4'}]}}
+        return html.format(id=deviation_id, head='', body=(
+            '<script type="text/javascript">deviantART.pageData={};</script>'.format(
+                json.dumps(page_data))))
+
+    def html(self, path, query):
+        """Returns the HTML served for a deviantArt path, None if unknown"""
+        offset = int(query.get('offset', 0))
+        config = self.config
+        match = re.match(r'/([^/]+)/art/bench-(\d+)$', path)
+        if match:
+            self.count('page')
+            return self.deviation(int(match.group(2)))
+        match = re.match(r'/([^/]+)/$', path)
+        if match:
+            return self.profile(match.group(1))
+        if path == '/' and 'q' in query:
+            self.count('listing')
+            return self.listing('searched', 500000, config.results, offset,
+                                24, 'Sorry, we found no relevant results.')
+        if path == '/{}/gallery/'.format(DEVIANT.lower()):
+            self.count('listing')
+            return self.listing(DEVIANT, 0, config.deviations, offset, 24,
+                                'This section has no deviations yet!')
+        if path == '/{}/gallery/'.format(GROUP.lower()):
+            self.count('listing')
+            return self.folder_listing(offset)
+        match = re.match(r'/{}/gallery/(\d+)/[\w-]+$'.format(GROUP.lower()), path)
+        if match:
+            self.count('listing')
+            return self.listing(GROUP, int(match.group(1)) * 1000,
+                                config.folder_deviations, offset, 24,
+                                'This section has no deviations yet!')
+
+
+class BenchRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'mp4': 'video/mp4'}
+
+    def do_GET(self):
+        gallery = self.server.gallery
+        parts = urlsplit(self.path)
+        # Requests for every host land here, only file paths start with /f/
+        if parts.path.startswith('/f/'):
+            return self.send_file(parts.path)
+        query = dict(pair.partition('=')[::2] for pair in parts.query.split('&') if pair)
+        html = gallery.html(parts.path, query)
+        if html is None:
+            return self.send_error(404)
+        sleep(gallery.config.latency)
+        body = html.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, path):
+        gallery = self.server.gallery
+        content_type = self.CONTENT_TYPES.get(path.rpartition('.')[2])
+        if not content_type:
+            return self.send_error(404)
+        size = gallery.config.file_size
+        sleep(gallery.config.file_latency)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(size))
+        self.send_header('Last-Modified', 'Wed, 21 Oct 2015 07:28:00 GMT')
+        self.end_headers()
+        block = b'\0' * 65536
+        left = size
+        while left > 0:
+            self.wfile.write(block[:left])
+            left -= len(block)
+        gallery.count('file', size)
+
+    def log_message(self, *args):
+        pass
+
+
+class BenchServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, gallery):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), BenchRequestHandler)
+        self.gallery = gallery
+
+
+class LocalPoolManager(PoolManager):
+    """Connects to the bench server whatever the host, one pool per host
+
+    Sitting below the ripper's adapter, requests keep their real URLs, so rate
+    limiting and profiling still see the hosts they would in production.
+    """
+    def __init__(self, address, **connection_pool_kw):
+        super(LocalPoolManager, self).__init__(**connection_pool_kw)
+        self.address = address
+        self.local_pools = {}
+        self.local_lock = threading.Lock()
+
+    def connection_from_host(self, host, port=None, scheme='http', pool_kwargs=None):
+        with self.local_lock:
+            if not host in self.local_pools:
+                self.local_pools[host] = self._new_pool('http', *self.address)
+            return self.local_pools[host]
+
+    def clear(self):
+        with self.local_lock:
+            for pool in self.local_pools.values():
+                pool.close()
+            self.local_pools = {}
+        super(LocalPoolManager, self).clear()
+
+
+def peak_rss():
+    """Returns the peak resident set size of the process in MB, if known"""
+    if not resource:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+@contextmanager
+def quiet(verbose):
+    if verbose:
+        yield
+        return
+    stdout = sys.stdout
+    with open(devnull, 'w') as sys.stdout:
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def rip_scenario(scenario, address, config):
+    """Runs in a process of its own, so peak RSS only covers this scenario"""
+    ripper = dagr.Dagr()
+    ripper.directory = tempfile.mkdtemp(prefix='dagr-bench-') + '/'
+    ripper.start_profile()
+    ripper.start()
+    adapter = ripper.browser.session.get_adapter('https://')
+    adapter.poolmanager = LocalPoolManager(
+        address, **adapter.poolmanager.connection_pool_kw)
+    start = time()
+    try:
+        with quiet(config.verbose):
+            if scenario == 'deviant':
+                ripper.deviant = DEVIANT
+                ripper.deviant_get('gallery')
+            elif scenario == 'group':
+                ripper.deviant = GROUP
+                ripper.group_get('gallery')
+            elif scenario == 'search':
+                ripper.global_search(QUERY)
+        elapsed = time() - start
+    finally:
+        ripper.stop_profile()
+        if not config.keep:
+            shutil.rmtree(ripper.directory, ignore_errors=True)
+    return elapsed, peak_rss(), ripper.errors_count
+
+
+def run_scenario(scenario, server, config):
+    before = server.gallery.snapshot()
+    with ProcessPoolExecutor(max_workers=1,
+                             mp_context=get_context('spawn')) as executor:
+        elapsed, rss, errors = executor.submit(
+            rip_scenario, scenario, server.server_address, config).result()
+    after = server.gallery.snapshot()
+    served = dict((key, after[key] - before[key]) for key in after)
+    return {
+        'scenario': scenario,
+        'seconds': elapsed,
+        'listing_pages': served['listing'],
+        'deviations': served['page'],
+        'files': served['file'],
+        'pages_per_second': served['listing'] / elapsed,
+        'deviations_per_second': served['page'] / elapsed,
+        'megabytes_per_second': served['bytes'] / elapsed / (1024.0 * 1024.0),
+        'peak_rss_mb': rss,
+        'errors': errors
+    }
+
+
+def print_help():
+    print("""Usage: dagr_bench.py [options]
+Rips synthetic galleries from a local server and reports throughput.
+Other settings (workers, page window...) come from dagr_settings.ini.
+
+--scenarios=LIST
+comma separated scenarios to run, default is deviant,group,search
+--deviations=COUNT
+deviations in the deviant gallery, default is 240
+--folders=COUNT
+--folder-deviations=COUNT
+folders in the group gallery and deviations in each, default is 8 and 30
+--results=COUNT
+search results, default is 240
+--file-size=BYTES
+size of each downloaded file, default is 262144
+--latency=SECONDS
+--file-latency=SECONDS
+server delay before answering pages and files, default is 0.02 and 0.05
+--json=FILE
+also write the results to FILE
+--keep
+keep the downloaded files
+-v, --verbose
+show the ripper output""")
+
+
+def main():
+    config = BenchConfig()
+    try:
+        options, _ = gnu_getopt(sys.argv[1:], 'hv', [
+            'help', 'verbose', 'keep', 'scenarios=', 'deviations=', 'folders=',
+            'folder-deviations=', 'results=', 'file-size=', 'latency=',
+            'file-latency=', 'json='])
+    except GetoptError as err:
+        print("Options error: " + str(err))
+        sys.exit()
+    for opt, arg in options:
+        if opt in ('-h', '--help'):
+            print_help()
+            sys.exit()
+        elif opt in ('-v', '--verbose'):
+            config.verbose = True
+        elif opt == '--keep':
+            config.keep = True
+        elif opt == '--scenarios':
+            config.scenarios = [x.strip() for x in arg.split(',') if x.strip()]
+        elif opt == '--json':
+            config.json_file = arg
+        elif opt in ('--latency', '--file-latency'):
+            setattr(config, opt[2:].replace('-', '_'), float(arg))
+        else:
+            setattr(config, opt[2:].replace('-', '_'), int(arg))
+    unknown = set(config.scenarios) - set(SCENARIOS)
+    if unknown:
+        print("Unknown scenarios: " + ", ".join(sorted(unknown)))
+        sys.exit()
+
+    server = BenchServer(SyntheticGallery(config))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    results = []
+    try:
+        for scenario in config.scenarios:
+            result = run_scenario(scenario, server, config)
+            results.append(result)
+            print('{scenario}: {seconds:.2f}s, {pages_per_second:.1f} pages/s, '
+                  '{deviations_per_second:.1f} deviations/s, '
+                  '{megabytes_per_second:.2f} MB/s'.format(**result)
+                  + (', peak RSS {:.1f} MB'.format(result['peak_rss_mb'])
+                     if result['peak_rss_mb'] else ''))
+            if result['errors']:
+                print('  errors: ' + json.dumps(result['errors']))
+    finally:
+        server.shutdown()
+        server.server_close()
+    if config.json_file:
+        with open(config.json_file, 'w') as filehandle:
+            json.dump(results, filehandle, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
-import dagr, json, traceback
-from dagr import run_ripper, add_mimetype
+import dagr, json, sys, traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from getopt import gnu_getopt, GetoptError
+from os.path import abspath, expanduser
+from dagr import run_ripper, resolve_deviants, add_mimetype
 
 class DagrBulkConfig():
     def __init__(self):
@@ -12,34 +16,84 @@ class DagrBulkConfig():
         self.scraps = []
         self.categories = {}
         self.searches = []
+        self.jobs = 1
+        self.concurrency = None
         with open('dagr_bulk.json', 'r') as filehandle:
             self.__dict__.update(json.load(filehandle))
 
-def main():
-    config = DagrBulkConfig()
-    ripper = dagr.Dagr()
-    add_mimetype('binary/octet-stream', '.bin')
-    ripper.retry_exception_names = ['OSError', 'ChunkedEncodingError', 'ConnectionError']
+def get_jobs(config):
     for query in config.searches:
-        ripper.start()
-        ripper.global_search(query)
+        yield partial(dagr.Dagr.global_search, query=query)
     for deviant, albums in config.albums.items():
-        run_ripper(ripper, [deviant], albums=albums)
-    if config.galleries:
-        run_ripper(ripper, config.galleries, galleries=True)
-    if config.scraps:
-        run_ripper(ripper, config.scraps, scraps=True)
+        yield partial(run_ripper, deviants=[deviant], albums=albums)
+    for deviant in config.galleries:
+        yield partial(run_ripper, deviants=[deviant], galleries=True)
+    for deviant in config.scraps:
+        yield partial(run_ripper, deviants=[deviant], scraps=True)
     for deviant, collections in config.collections.items():
-       run_ripper(ripper, [deviant], collections=collections)
+        yield partial(run_ripper, deviants=[deviant], collections=collections)
     for deviant, queries in config.queries.items():
-        run_ripper(ripper, [deviant], queries=queries)
+        yield partial(run_ripper, deviants=[deviant], queries=queries)
     for deviant, category in config.categories.items():
-        run_ripper(ripper, [deviant], categories=category)
-    if config.favs:
-        run_ripper(ripper, config.favs, favs=True)
+        yield partial(run_ripper, deviants=[deviant], categories=category)
+    for deviant in config.favs:
+        yield partial(run_ripper, deviants=[deviant], favs=True)
+
+def run_job(ripper, job):
+    try:
+        job(ripper)
+    except Exception:
+        traceback.print_exc()
+    return ripper.errors_count
+
+def main():
+    try:
+        options, _ = gnu_getopt(sys.argv[1:], '', ['profile', 'profile-dump='])
+    except GetoptError as err:
+        print("Options error: " + str(err))
+        sys.exit()
+    config = DagrBulkConfig()
+    ripper = dagr.Dagr()
+    for opt, arg in options:
+        if opt == '--profile':
+            ripper.profile = True
+        elif opt == '--profile-dump':
+            ripper.profile_dump = abspath(expanduser(arg))
+    add_mimetype('binary/octet-stream', '.bin')
+    ripper.retry_exception_names = ['OSError', 'ChunkedEncodingError', 'ConnectionError']
+    ripper.start_profile()
+    try:
+        run_jobs(config, ripper)
+    finally:
+        ripper.stop_profile()
     ripper.print_errors()
+    ripper.write_report()
+
+def run_jobs(config, ripper):
+    jobs = list(get_jobs(config))
+    deviants = [job.keywords['deviants'][0] for job in jobs
+                if 'deviants' in job.keywords]
+    if config.jobs <= 1:
+        ripper.start()
+        resolve_deviants(ripper, deviants)
+        for job in jobs:
+            job(ripper)
+        return
+    # Jobs share one session sized for the whole budget, split between them
+    ripper.workers = config.concurrency or ripper.workers * config.jobs
+    ripper.start()
+    resolve_deviants(ripper, deviants)
+    job_workers = max(1, ripper.workers // config.jobs)
+    with ThreadPoolExecutor(max_workers=config.jobs) as executor:
+        futures = []
+        for job in jobs:
+            job_ripper = ripper.fork()
+            job_ripper.workers = job_workers
+            futures.append(executor.submit(run_job, job_ripper, job))
+        for future in futures:
+            ripper.merge_errors(future.result())
 
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -32,5 +32,6 @@ setup(
     scripts=['dagr/dagr.py', 'dagr/dagr_bulk.py'],
     data_files=[('share/dagr', ['dagr_settings.ini.sample'])],
     packages=(),
+    python_requires='>=3.7',
     install_requires=["MechanicalSoup >= 0.10.0", 'portalocker'],
 )